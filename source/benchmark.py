@@ -0,0 +1,665 @@
+# -*- coding: utf-8 -*-
+"""Benchmark and accuracy-regression program for pytwobodyorbit
+
+Measures throughput (calls per second) of posvelatt, setOrbCart,
+setOrbKepl, a request (setOrbCart and posvelatt for one time), points,
+lambert, and lambert_batch for circular, elliptic,
+near-parabolic, and hyperbolic cases, and short and long flight time
+Lambert problems.  Errors of position and velocity are measured against a
+reference solution computed with 50 significant digits (decimal module),
+over spans of periods and over short times from epoch (posvelatt_short).
+Startup time of fresh interpreters importing the module is measured, and
+SCIPY LOADED is reported if an import case loaded SciPy (SciPy should be
+loaded only when a root finder is needed).
+Fallbacks (to bisection) of the universal-variable solver for
+near-parabolic orbits and tiny time steps are counted, and lambert is
+measured for near-parabolic transfers (z close to 0), where the Stumpff
+functions need series expansions.
+Regression checks (check_stumpff) fail if the universal-variable solver
+falls back to bisection for these cases, or if the series and the closed
+forms of the Stumpff functions do not agree where they are switched.
+Batch benchmarks (posvelatt_array, cart_to_kepl, kepl_to_cart, lambert_batch,
+and parallel propagation with 1, 2, 4, ... worker processes) report states
+or problems per second.
+
+Usage:
+    python benchmark.py [--quick] [--check] [--output FILE] [--compare FILE]
+
+    --quick: fewer repetitions of timing
+    --check: runs only the regression checks
+    The exit status is 1 if a regression check fails, or if an ACCURACY
+    REGRESSION or MORE FALLBACKS is reported by --compare.
+    --output: writes the results into FILE as JSON
+    --compare: compares the results with previous results in FILE; speedup
+               is shown for each benchmark, errors grown more than ten
+               times are reported as ACCURACY REGRESSION, and increased
+               fallbacks are reported as MORE FALLBACKS
+
+@author: Shushi Uetsuki/whiskie14142
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+from decimal import Decimal, getcontext
+
+import numpy as np
+import pytwobodyorbit
+from pytwobodyorbit import TwoBodyOrbit
+from pytwobodyorbit import lambert
+from pytwobodyorbit import lambert_batch
+from pytwobodyorbit import cart_to_kepl
+from pytwobodyorbit import kepl_to_cart
+from pytwobodyorbit import LAMBERT_OK
+from pytwobodyorbit import OrbitSet
+from pytwobodyorbit import SolverStats
+from parallel import propagate
+
+# Standard gravitational parameter for the Sun
+# With this parameter, lenght should be in meters,
+# and time should be in seconds
+sunmu = 1.32712440041e20
+
+# Seconds of a day
+secofday = 86400.0
+
+# Orbits for the benchmark: name, e, periapsis distance, i, LoAN, AoP, TA
+CASES = [('circular', 0.0, 1.496e11, 0.0, 0.0, 0.0, 30.0),
+         ('elliptic', 0.3, 1.2e11, 10.0, 40.0, 60.0, 120.0),
+         ('high-ecc', 0.97, 0.6e11, 35.0, 80.0, 150.0, 20.0),
+         ('near-parabolic', 0.9999, 1.0e11, 60.0, 120.0, 270.0, -40.0),
+         ('near-parabolic-hyp', 1.0001, 1.0e11, 60.0, 120.0, 270.0, -40.0),
+         ('hyperbolic', 2.5, 1.5e11, 120.0, 200.0, 30.0, 60.0)]
+
+# Lambert problems: name, ipos, tpos, flight time in days, ccw
+LAMBERT_CASES = [('short-tof', [1.5e11, 0.0, 0.0], [1.2e11, 0.9e11, 0.1e11],
+                  20.0, True),
+                 ('medium-tof', [1.5e11, 0.0, 0.0], [-0.5e11, 1.3e11, 0.4e11],
+                  100.0, True),
+                 ('medium-tof-retro', [1.5e11, 0.0, 0.0],
+                  [-0.5e11, 1.3e11, 0.4e11], 100.0, False),
+                 ('long-tof', [1.5e11, 0.0, 0.0], [-2.0e11, -1.0e11, 0.1e11],
+                  300.0, True),
+                 ('long-tof-retro', [1.5e11, 0.0, 0.0],
+                  [-2.0e11, -1.0e11, 0.1e11], 300.0, False),
+                 ('large-dnu', [1.5e11, 0.0, 0.0], [1.4e11, -0.6e11, 0.0],
+                  200.0, True)]
+
+# Times from epoch for accuracy of short propagations
+SHORT_TIMES = [1.0, 1.0e3, 1.0e5, -1.0e3]
+
+# Cases of fallback counts: name, e, periapsis distance, time steps
+FALLBACK_CASES = [('near-parabolic', 0.9999, 1.0e11,
+                   np.linspace(-3e7, 3e7, 15)),
+                  ('near-parabolic-hyp', 1.0001, 1.0e11,
+                   np.linspace(-3e7, 3e7, 15)),
+                  ('near-parabolic/tiny-dt', 0.99999, 1.0e11,
+                   np.logspace(-6.0, 2.0, 15)),
+                  ('elliptic/tiny-dt', 0.3, 1.2e11, np.logspace(-6.0, 1.0, 15)),
+                  ('hyperbolic/tiny-dt', 2.5, 1.5e11,
+                   np.logspace(-6.0, 1.0, 15))]
+
+# Eccentricities of near-parabolic Lambert problems
+NEAR_PARABOLIC_LAMBERT = [0.99999, 1.0 - 1e-9, 1.0 + 1e-9, 1.00001]
+
+# Values of z around |z| = 1, where the Stumpff functions are switched from
+# series to closed forms, and the tolerance of their relative difference
+STUMPFF_SWITCH_Z = np.concatenate([sg * np.array([np.nextafter(1.0, 0.0), 1.0,
+    np.nextafter(1.0, 2.0), 0.999, 1.001]) for sg in (1.0, -1.0)])
+STUMPFF_SWITCH_TOL = 2e-15
+
+# Reference solution with 50 significant digits
+getcontext().prec = 50
+_DPI = Decimal('3.14159265358979323846264338327950288419716939937510582')
+
+
+def _dsincos(x):
+    """sin(x) and cos(x) of a Decimal by Taylor series"""
+    twopi = _DPI * 2
+    x = x - twopi * (x / twopi).to_integral_value()
+    term = x
+    s = x
+    c = Decimal(1)
+    cterm = Decimal(1)
+    k = 1
+    while True:
+        cterm = cterm * (-1) * x * x / ((2 * k - 1) * (2 * k))
+        term = term * (-1) * x * x / ((2 * k) * (2 * k + 1))
+        if abs(term) < Decimal('1e-60') and abs(cterm) < Decimal('1e-60'):
+            break
+        c += cterm
+        s += term
+        k += 1
+    return s, c
+
+
+def _dstumpff(z):
+    """Stumpff functions C(z) and S(z) of a Decimal"""
+    if abs(z) < Decimal('1e-3'):
+        # series; enough terms for 50 digits
+        c = Decimal(0)
+        s = Decimal(0)
+        term_c = Decimal(1) / 2
+        term_s = Decimal(1) / 6
+        for k in range(1, 16):
+            c += term_c
+            s += term_s
+            term_c = term_c * (-1) * z / ((2 * k + 1) * (2 * k + 2))
+            term_s = term_s * (-1) * z / ((2 * k + 2) * (2 * k + 3))
+        return c, s
+    if z > 0:
+        sqz = z.sqrt()
+        sn, cs = _dsincos(sqz)
+        return (1 - cs) / z, (sqz - sn) / sqz ** 3
+    sqz = (-z).sqrt()
+    ex = sqz.exp()
+    sh = (ex - 1 / ex) / 2
+    ch = (ex + 1 / ex) / 2
+    return (1 - ch) / z, (sh - sqz) / sqz ** 3
+
+
+def refposvel(pos, vel, delta_t, mu):
+    """Reference position and velocity after delta_t
+
+    The universal-variable Kepler equation is solved with 50 significant
+    digits by Newton iteration safeguarded with bisection.  The root is
+    bracketed from x = 0, where the function is -delta_t (it increases
+    with x), so that the reference does not depend on the solvers of
+    pytwobodyorbit.
+    """
+    p = [Decimal(float(v)) for v in pos]
+    v = [Decimal(float(w)) for w in vel]
+    dt = Decimal(float(delta_t))
+    dmu = Decimal(mu)
+    sqmu = dmu.sqrt()
+    r0 = sum(a * a for a in p).sqrt()
+    rdotv = sum(a * b for a, b in zip(p, v))
+    alpha = 2 / r0 - sum(a * a for a in v) / dmu
+    sigma = rdotv / sqmu
+
+    def kepler(x):
+        z = alpha * x * x
+        c, s = _dstumpff(z)
+        f = (sigma * x * x * c + (1 - alpha * r0) * x ** 3 * s + r0 * x) \
+            / sqmu - dt
+        fp = (x * x * c + sigma * x * (1 - z * s) + r0 * (1 - z * c)) / sqmu
+        return f, fp
+
+    # bracket [lo, hi]; steps start from the guess for short delta_t, and
+    # for a hyperbola they are limited so that exp(sqrt(-alpha) * x) is
+    # representable
+    step = sqmu * abs(dt) / r0
+    if alpha < 0:
+        step = min(step, 1000 / (-alpha).sqrt())
+    lo = hi = Decimal(0)
+    if dt > 0:
+        hi = step
+        while kepler(hi)[0] < 0:
+            lo, hi = hi, hi * 2
+    elif dt < 0:
+        lo = -step
+        while kepler(lo)[0] > 0:
+            lo, hi = lo * 2, lo
+    x = (lo + hi) / 2
+    for i in range(500):
+        if lo == hi:
+            break
+        f, fp = kepler(x)
+        if f == 0:
+            break
+        if f < 0:
+            lo = x
+        else:
+            hi = x
+        xn = x - f / fp
+        if not lo < xn < hi:
+            xn = (lo + hi) / 2
+        dx = xn - x
+        x = xn
+        if abs(dx) <= abs(x) * Decimal('1e-45'):
+            break
+    z = alpha * x * x
+    c, s = _dstumpff(z)
+    val_f = 1 - x * x / r0 * c
+    val_g = dt - x ** 3 / sqmu * s
+    newpos = [a * val_f + b * val_g for a, b in zip(p, v)]
+    newr = sum(a * a for a in newpos).sqrt()
+    val_fd = sqmu / r0 / newr * x * (z * s - 1)
+    val_gd = 1 - x * x / newr * c
+    newvel = [a * val_fd + b * val_gd for a, b in zip(p, v)]
+    return (np.array([float(a) for a in newpos]),
+            np.array([float(a) for a in newvel]))
+
+
+def relerr(val, ref):
+    """Relative error of a vector"""
+    return float(np.sqrt(np.sum((np.asarray(val) - ref) ** 2))
+                 / np.sqrt(np.sum(ref * ref)))
+
+
+def timecall(func, quick=False):
+    """Returns calls per second of func"""
+    number = 1
+    while True:
+        sec = timeit.timeit(func, number=number)
+        if sec > (0.02 if quick else 0.1):
+            break
+        number *= 4
+    best = min(timeit.repeat(func, number=number, repeat=2 if quick else 5))
+    return number / best
+
+
+def make_orbit(case, solver='anomaly'):
+    name, e, q, i, lan, aop, ta = case
+    orbit = TwoBodyOrbit(name, mu=sunmu, solver=solver)
+    a = q / (1.0 - e) if e != 1.0 else q
+    orbit.setOrbKepl(0.0, a, e, i, lan, aop, TA=ta)
+    # redefine by the state vector, so that the orbit is exactly the one
+    # propagated by the reference solution
+    orbit.setOrbCart(0.0, orbit.pos, orbit.vel)
+    return orbit
+
+
+def sample_times(orbit):
+    """Propagation times; up to ten periods (or 2 years for hyperbolas)"""
+    if orbit.e < 1.0:
+        span = min(orbit.pr * 10.0, 1e4 * 365.25 * secofday)
+    else:
+        span = 2.0 * 365.25 * secofday
+    return np.linspace(-span / 3.0, span, 13)
+
+
+def bench_propagation(quick=False):
+    records = []
+    for case in CASES:
+        for solver in ('anomaly', 'universal'):
+            orbit = make_orbit(case, solver)
+            times = sample_times(orbit)
+            perr = 0.0
+            verr = 0.0
+            for t in times:
+                pos, vel = orbit.posvelatt(t)
+                rpos, rvel = refposvel(orbit.pos, orbit.vel, t - orbit.t0,
+                                       sunmu)
+                perr = max(perr, relerr(pos, rpos))
+                verr = max(verr, relerr(vel, rvel))
+            tcall = times[-3]
+            records.append({'name':'posvelatt/{}/{}'.format(case[0], solver),
+                'calls_per_sec':timecall(lambda: orbit.posvelatt(tcall),
+                                         quick),
+                'max_pos_err':perr, 'max_vel_err':verr})
+
+            # short times from epoch, where errors of the mean anomaly at
+            # epoch (or of T) are not hidden by the span
+            perr = 0.0
+            verr = 0.0
+            for dt in SHORT_TIMES:
+                pos, vel = orbit.posvelatt(orbit.t0 + dt)
+                rpos, rvel = refposvel(orbit.pos, orbit.vel, dt, sunmu)
+                perr = max(perr, relerr(pos, rpos))
+                verr = max(verr, relerr(vel, rvel))
+            records.append({'name':'posvelatt_short/{}/{}'.format(case[0],
+                solver), 'calls_per_sec':timecall(lambda: orbit.posvelatt(
+                orbit.t0 + SHORT_TIMES[1]), quick),
+                'max_pos_err':perr, 'max_vel_err':verr})
+
+            tarr = np.linspace(times[0], times[-1], 10000)
+            apos, avel = orbit.posvelatt(tarr)
+            perr = 0.0
+            verr = 0.0
+            for k in range(0, tarr.shape[0], 1250):
+                rpos, rvel = refposvel(orbit.pos, orbit.vel,
+                                       tarr[k] - orbit.t0, sunmu)
+                perr = max(perr, relerr(apos[k], rpos))
+                verr = max(verr, relerr(avel[k], rvel))
+            rate = timecall(lambda: orbit.posvelatt(tarr), quick)
+            records.append({'name':'posvelatt_array/{}/{}'.format(case[0],
+                solver), 'calls_per_sec':rate * tarr.shape[0],
+                'max_pos_err':perr, 'max_vel_err':verr})
+    return records
+
+
+def bench_conversion(quick=False):
+    records = []
+    for case in CASES:
+        orbit = make_orbit(case)
+        t0 = orbit.t0
+        pos = orbit.pos.copy()
+        vel = orbit.vel.copy()
+        kepl = orbit.elmKepl()
+        other = TwoBodyOrbit('other', mu=sunmu)
+
+        # round trip: Cartesian -> classical -> Cartesian
+        other.setOrbCart(t0, pos, vel)
+        elm = other.elmKepl()
+        other.setOrbKepl(elm['epoch'], elm['a'], elm['e'], elm['i'],
+                         elm['LoAN'], elm['AoP'], TA=elm['TA'])
+        records.append({'name':'setOrbCart/{}'.format(case[0]),
+            'calls_per_sec':timecall(lambda: other.setOrbCart(t0, pos, vel),
+                                     quick),
+            'max_pos_err':relerr(other.pos, pos),
+            'max_vel_err':relerr(other.vel, vel)})
+
+        args = (kepl['epoch'], kepl['a'], kepl['e'], kepl['i'], kepl['LoAN'],
+                kepl['AoP'])
+        records.append({'name':'setOrbKepl/{}'.format(case[0]),
+            'calls_per_sec':timecall(lambda: other.setOrbKepl(*args,
+                                     TA=kepl['TA']), quick),
+            'max_pos_err':None, 'max_vel_err':None})
+        if orbit.e < 1.0:
+            records.append({'name':'setOrbKepl-MA/{}'.format(case[0]),
+                'calls_per_sec':timecall(lambda: other.setOrbKepl(*args,
+                                         MA=kepl['MA']), quick),
+                'max_pos_err':None, 'max_vel_err':None})
+
+        # one request of a service: define an orbit by a state vector,
+        # and propagate it to one time
+        tq = sample_times(orbit)[-3]
+        records.append({'name':'request/{}'.format(case[0]),
+            'calls_per_sec':timecall(lambda: (other.setOrbCart(t0, pos, vel),
+                                     other.posvelatt(tq)), quick),
+            'max_pos_err':None, 'max_vel_err':None})
+
+        records.append({'name':'points/{}'.format(case[0]),
+            'calls_per_sec':timecall(lambda: orbit.points(1000), quick),
+            'max_pos_err':None, 'max_vel_err':None})
+
+    # batch of random states (rates are states per second)
+    rng = np.random.default_rng(12345)
+    n = 10000
+    t0 = rng.uniform(0.0, 365.25 * secofday, n)
+    pos = rng.normal(size=(n, 3)) * 1.5e11
+    vel = rng.normal(size=(n, 3)) * 3.0e4
+    kepl = cart_to_kepl(t0, pos, vel, sunmu)
+    rate = timecall(lambda: cart_to_kepl(t0, pos, vel, sunmu), quick)
+    records.append({'name':'cart_to_kepl/random', 'calls_per_sec':rate * n,
+        'max_pos_err':None, 'max_vel_err':None})
+    cart = kepl_to_cart(kepl, mu=sunmu)
+    rate = timecall(lambda: kepl_to_cart(kepl, mu=sunmu), quick)
+    records.append({'name':'kepl_to_cart/random', 'calls_per_sec':rate * n,
+        'max_pos_err':max(relerr(cart['pos'][k], pos[k]) for k in range(n)),
+        'max_vel_err':max(relerr(cart['vel'][k], vel[k]) for k in range(n))})
+    return records
+
+
+def bench_lambert(quick=False):
+    records = []
+    for name, ipos, tpos, days, ccw in LAMBERT_CASES:
+        ipos = np.array(ipos)
+        tpos = np.array(tpos)
+        tof = days * secofday
+        ivel, tvel = lambert(ipos, tpos, tof, sunmu, ccw)
+        rpos, rvel = refposvel(ipos, ivel, tof, sunmu)
+        records.append({'name':'lambert/{}'.format(name),
+            'calls_per_sec':timecall(lambda: lambert(ipos, tpos, tof, sunmu,
+                                     ccw), quick),
+            'max_pos_err':relerr(rpos, tpos),
+            'max_vel_err':relerr(tvel, rvel)})
+
+    # batch of random problems
+    rng = np.random.default_rng(12345)
+    n = 2000
+    ipos = rng.normal(size=(n, 3)) * 1.5e11
+    tpos = rng.normal(size=(n, 3)) * 1.5e11
+    tof = rng.uniform(10.0, 500.0, n) * secofday
+    ivel, tvel, status = lambert_batch(ipos, tpos, tof, sunmu)
+    perr = 0.0
+    verr = 0.0
+    for k in np.flatnonzero(status == LAMBERT_OK)[:20]:
+        rpos, rvel = refposvel(ipos[k], ivel[k], tof[k], sunmu)
+        perr = max(perr, relerr(rpos, tpos[k]))
+        verr = max(verr, relerr(tvel[k], rvel))
+    rate = timecall(lambda: lambert_batch(ipos, tpos, tof, sunmu), quick)
+    records.append({'name':'lambert_batch/random', 'calls_per_sec':rate * n,
+        'max_pos_err':perr, 'max_vel_err':verr})
+    return records
+
+
+# Programs run in fresh interpreters by bench_import; each prints elapsed
+# seconds and whether SciPy has been loaded
+IMPORT_CASES = [('import/pytwobodyorbit', ''),
+                ('import/elements', """
+orbit = pytwobodyorbit.TwoBodyOrbit('probe')
+orbit.setOrbKepl(0.0, 1.5e11, 0.3, 10.0, 40.0, 60.0, MA=120.0)
+orbit.elmKepl()
+pytwobodyorbit.cart_to_kepl(0.0, [orbit.pos], [orbit.vel])
+""")]
+
+
+def bench_import(quick=False):
+    """Startup time of fresh interpreters that import pytwobodyorbit
+    
+    calls_per_sec is the inverse of the best elapsed time of the import
+    (and of the element conversions of the case).
+    """
+    records = []
+    directory = os.path.dirname(os.path.abspath(pytwobodyorbit.__file__))
+    for name, body in IMPORT_CASES:
+        program = ('import sys, time\nstart = time.perf_counter()\n'
+                   'import pytwobodyorbit\n' + body
+                   + '\nprint(time.perf_counter() - start, '
+                   "'scipy' in sys.modules)\n")
+        best = None
+        for k in range(3 if quick else 10):
+            out = subprocess.run([sys.executable, '-c', program], cwd=directory,
+                                 check=True, capture_output=True,
+                                 text=True).stdout.split()
+            sec = float(out[0])
+            best = sec if best is None else min(best, sec)
+        records.append({'name':name, 'calls_per_sec':1.0 / best,
+            'max_pos_err':None, 'max_vel_err':None,
+            'scipy_loaded':out[1] == 'True'})
+    return records
+
+
+def bench_parallel(quick=False):
+    """Throughput of parallel.propagate versus number of worker processes
+    
+    calls_per_sec is states (orbits times times) per second, including
+    startup of the process pool.
+    """
+    records = []
+    rng = np.random.default_rng(12345)
+    n = 2000 if quick else 10000
+    orbits = OrbitSet(mu=sunmu)
+    orbits.setOrbKepl(0.0, rng.uniform(0.5e11, 3e11, n), rng.uniform(0.0, 0.9,
+        n), rng.uniform(0.0, 180.0, n), rng.uniform(0.0, 360.0, n),
+        rng.uniform(0.0, 360.0, n), MA=rng.uniform(0.0, 360.0, n))
+    times = np.linspace(0.0, 365.25 * secofday, 100)
+    refpos, refvel = propagate(orbits, times)
+    workers = [k for k in (1, 2, 4, 8, 16)
+               if k <= max(2, os.cpu_count() or 1)]
+    for k in workers:
+        pos, vel = propagate(orbits, times, processes=k)
+        rate = timecall(lambda: propagate(orbits, times, processes=k), quick)
+        records.append({'name':'parallel/workers={}'.format(k),
+            'calls_per_sec':rate * n * times.shape[0],
+            'max_pos_err':relerr(pos, refpos),
+            'max_vel_err':relerr(vel, refvel)})
+    return records
+
+
+def bench_stumpff(quick=False):
+    """Fallbacks of the universal-variable solver, and lambert near z = 0
+    
+    For FALLBACK_CASES, fallbacks (to bisection) of posvelatt for a time and
+    for an array of times are counted with SolverStats and stored in the
+    'fallbacks' key. Lambert problems are between two points of
+    near-parabolic orbits, and errors of velocities are measured against
+    the orbits.
+    """
+    records = []
+    for name, e, q, steps in FALLBACK_CASES:
+        orbit = make_orbit((name, e, q, 20.0, 30.0, 40.0, -30.0), 'universal')
+        perr = 0.0
+        verr = 0.0
+        with SolverStats() as stats:
+            for dt in steps:
+                pos, vel = orbit.posvelatt(orbit.t0 + dt)
+                rpos, rvel = refposvel(orbit.pos, orbit.vel, dt, sunmu)
+                perr = max(perr, relerr(pos, rpos))
+                verr = max(verr, relerr(vel, rvel))
+        records.append({'name':'fallbacks/{}'.format(name),
+            'calls_per_sec':timecall(lambda: [orbit.posvelatt(orbit.t0 + dt)
+                for dt in steps], quick) * steps.shape[0],
+            'max_pos_err':perr, 'max_vel_err':verr,
+            'fallbacks':stats.totals['posvelatt.universal']['fallbacks']})
+        
+        with SolverStats() as stats:
+            orbit.posvelatt(orbit.t0 + steps)
+        records.append({'name':'fallbacks_array/{}'.format(name),
+            'calls_per_sec':timecall(lambda: orbit.posvelatt(orbit.t0
+                + steps), quick) * steps.shape[0],
+            'max_pos_err':None, 'max_vel_err':None,
+            'fallbacks':stats.totals['posvelatt.universal']['fallbacks']})
+    
+    tof = 80.0 * secofday
+    for e in NEAR_PARABOLIC_LAMBERT:
+        orbit = make_orbit(('lambert', e, 1.0e11, 0.0, 0.0, 0.0, -60.0))
+        tpos, tvel = refposvel(orbit.pos, orbit.vel, tof, sunmu)
+        with SolverStats() as stats:
+            ivel, ovel = lambert(orbit.pos, tpos, tof, sunmu, True)
+        records.append({'name':'lambert/near-parabolic/e={!r}'.format(e),
+            'calls_per_sec':timecall(lambda: lambert(orbit.pos, tpos, tof,
+                sunmu, True), quick),
+            'max_pos_err':None,
+            'max_vel_err':max(relerr(ivel, orbit.vel), relerr(ovel, tvel)),
+            'fallbacks':stats.totals['lambert']['fallbacks']})
+    return records
+
+
+def check_stumpff():
+    """Regression checks of the Stumpff functions and of the
+    universal-variable solver
+    
+    Raises AssertionError if posvelatt (for a time, or for an array of
+    times) falls back to bisection for a case of FALLBACK_CASES, or if the
+    series and the closed forms of the Stumpff functions, or the float
+    path of _stumpff and the reference, differ by more than
+    STUMPFF_SWITCH_TOL at STUMPFF_SWITCH_Z.
+    """
+    for name, e, q, steps in FALLBACK_CASES:
+        orbit = make_orbit((name, e, q, 20.0, 30.0, 40.0, -30.0), 'universal')
+        with SolverStats() as stats:
+            for dt in steps:
+                orbit.posvelatt(orbit.t0 + dt)
+            orbit.posvelatt(orbit.t0 + steps)
+        fallbacks = stats.totals['posvelatt.universal']['fallbacks']
+        assert fallbacks == 0, '{} fallbacks for {}'.format(fallbacks, name)
+    
+    z = STUMPFF_SWITCH_Z
+    series = pytwobodyorbit._stumpff_series(z)
+    closed = pytwobodyorbit._stumpff_closed(z)
+    for k, fname in enumerate(('C', 'S')):
+        diff = np.max(np.abs(series[k] - closed[k]) / np.abs(closed[k]))
+        assert diff <= STUMPFF_SWITCH_TOL, \
+            'series and closed form of {}(z) differ by {:.1e}'.format(fname,
+            diff)
+    for zk in z:
+        ref = _dstumpff(Decimal(float(zk)))
+        val = pytwobodyorbit._stumpff(float(zk))
+        for k, fname in enumerate(('C', 'S')):
+            err = abs(val[k] - float(ref[k])) / float(ref[k])
+            assert err <= STUMPFF_SWITCH_TOL, \
+                'error of {}({!r}) is {:.1e}'.format(fname, float(zk), err)
+
+
+def run(quick=False):
+    """Runs all benchmarks and returns the results as a dictionary"""
+    results = {'python':platform.python_version(),
+               'numpy':np.__version__,
+               'machine':platform.machine(),
+               'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'records':[]}
+    for bench in (bench_import, bench_propagation, bench_conversion,
+                  bench_lambert, bench_stumpff, bench_parallel):
+        results['records'].extend(bench(quick))
+    return results
+
+
+def fmterr(err):
+    return '{:9.1e}'.format(err) if err is not None else '        -'
+
+
+def report(results, previous=None):
+    """Prints the results, compared with previous results if given
+    
+    Returns True if an ACCURACY REGRESSION or MORE FALLBACKS is reported.
+    """
+    regressed = False
+    prev = {}
+    if previous is not None:
+        prev = {rec['name']:rec for rec in previous['records']}
+    print('{:<44s} {:>14s} {:>9s} {:>9s}{}'.format('benchmark', 'calls/sec',
+          'pos err', 'vel err', '   speedup' if prev else ''))
+    for rec in results['records']:
+        line = '{:<44s} {:14.1f} {} {}'.format(rec['name'],
+               rec['calls_per_sec'], fmterr(rec['max_pos_err']),
+               fmterr(rec['max_vel_err']))
+        if rec.get('scipy_loaded'):
+            line += '  SCIPY LOADED'
+        if rec.get('fallbacks'):
+            line += '  fallbacks={}'.format(rec['fallbacks'])
+        if rec['name'] in prev:
+            old = prev[rec['name']]
+            line += ' {:9.2f}x'.format(rec['calls_per_sec']
+                                       / old['calls_per_sec'])
+            if accuracy_regressed(rec, old):
+                line += '  ACCURACY REGRESSION'
+                regressed = True
+            if rec.get('fallbacks', 0) > old.get('fallbacks', 0):
+                line += '  MORE FALLBACKS'
+                regressed = True
+        print(line)
+    return regressed
+
+
+def accuracy_regressed(rec, old, factor=10.0, floor=1e-13):
+    """True if an error became larger than factor times the previous one
+    (errors below floor are regarded as round-off)"""
+    for key in ('max_pos_err', 'max_vel_err'):
+        if rec[key] is None or old.get(key) is None:
+            continue
+        if rec[key] > max(old[key] * factor, floor):
+            return True
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of pytwobodyorbit')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer repetitions of timing')
+    parser.add_argument('--check', action='store_true',
+                        help='run only the regression checks')
+    parser.add_argument('--output', help='write results into a JSON file')
+    parser.add_argument('--compare', help='compare with a previous JSON file')
+    args = parser.parse_args(argv)
+
+    try:
+        check_stumpff()
+    except AssertionError as exc:
+        print('CHECK FAILED: {}'.format(exc))
+        return 1
+    if args.check:
+        print('checks passed')
+        return 0
+
+    results = run(args.quick)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    regressed = report(results, previous)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
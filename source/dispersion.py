@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Monte Carlo dispersion of two-body orbits with pytwobodyorbit
+
+This module draws perturbed initial states around the state of a
+TwoBodyOrbit at its epoch from a given covariance, propagates them, and
+computes summary statistics (mean, covariance, minimum, and maximum) of the
+propagated states.
+
+Samples are drawn and propagated in chunks with OrbitSet, and statistics of
+each chunk are merged into running statistics, so that the full sample is
+never held in memory.  Each chunk has its own random generator spawned from
+one numpy.random.SeedSequence, so that the results are reproducible for a
+seed and a chunk size, regardless of the number of worker processes.
+
+@author: Shushi Uetsuki/whiskie14142
+"""
+
+import numpy as np
+from pytwobodyorbit import OrbitSet
+from parallel import chunking
+from parallel import map_chunks
+
+
+def _dispersion_chunk(t0, state, cov, times, mu, nsamples, seedseq):
+    """Draws nsamples states from the generator of seedseq, propagates
+    them to times, and returns their count, mean, sum of squared deviations,
+    minimum, and maximum"""
+    rng = np.random.default_rng(seedseq)
+    samples = rng.multivariate_normal(state, cov, size=nsamples)
+    orbits = OrbitSet(mu=mu)
+    orbits.setOrbCart(t0, samples[:, :3], samples[:, 3:])
+    newpos, newvel = orbits.posvelatt(times)
+    states = np.concatenate((newpos, newvel), axis=2)   # (n,M,6)
+
+    mean = states.mean(axis=0)
+    dev = states - mean
+    m2 = np.einsum('nmi,nmj->mij', dev, dev)
+    return nsamples, mean, m2, states.min(axis=0), states.max(axis=0)
+
+
+def _merge(stats, chunk):
+    """Merges statistics of a chunk into running statistics
+
+    Means and sums of squared deviations are merged by the pairwise
+    formulas of Chan et al.
+    """
+    if stats is None:
+        return chunk
+    na, meana, m2a, mina, maxa = stats
+    nb, meanb, m2b, minb, maxb = chunk
+    n = na + nb
+    delta = meanb - meana
+    mean = meana + delta * (nb / n)
+    m2 = m2a + m2b + delta[:, :, None] * delta[:, None, :] * (na * nb / n)
+    return n, mean, m2, np.minimum(mina, minb), np.maximum(maxa, maxb)
+
+
+def _summary(times, stats):
+    n, mean, m2, smin, smax = stats
+    return {'times':times,
+        'count':n,
+        'mean':mean,
+        'cov':m2 / (n - 1) if n > 1 else np.full(m2.shape, np.nan),
+        'min':smin,
+        'max':smax}
+
+
+def dispersion_chunks(orbit, cov, times, nsamples, seed=None, chunksize=10000,
+                      processes=1):
+    """Generator of running statistics of a Monte Carlo dispersion
+
+    Args: see dispersion()
+    Yields: summary
+        summary: Dictionary of statistics of all samples propagated so far
+                 (see dispersion()); one summary is yielded for each chunk
+    """
+    if not orbit._setOrb:
+        raise(RuntimeError('Orbit has not been defined: dispersion.dispersion'))
+    cov = np.asarray(cov, dtype=float)
+    if cov.shape != (6, 6):
+        raise(ValueError('Shape of cov should be (6,6): dispersion.dispersion'))
+    times = np.atleast_1d(np.asarray(times, dtype=float))
+    state = np.concatenate((orbit.pos, orbit.vel))
+
+    processes, chunksize = chunking(nsamples, processes, chunksize)
+    sizes = [min(chunksize, nsamples - s) for s in range(0, nsamples,
+             chunksize)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(orbit.t0, state, cov, times, orbit.mu, size, seedseq)
+            for size, seedseq in zip(sizes, seeds)]
+
+    stats = None
+    # results are merged in order of chunks, so that they do not depend on
+    # the number of processes
+    for chunk in map_chunks(_dispersion_chunk, args, processes):
+        stats = _merge(stats, chunk)
+        yield _summary(times, stats)
+
+
+def dispersion(orbit, cov, times, nsamples, seed=None, chunksize=10000,
+               processes=1):
+    """Computes a Monte Carlo dispersion of a two-body orbit
+
+    Args:
+        orbit: TwoBodyOrbit instance of the nominal orbit; samples are drawn
+               around its state (pos, vel) at its epoch (t0)
+        cov: Covariance of the state (x,y,z,xd,yd,zd) at epoch, (6,6)
+             array-like object
+        times: Time, or array-like object of M times
+        nsamples: Number of samples
+        seed: Seed of numpy.random.SeedSequence (int, or None for fresh
+              entropy)
+        chunksize: Number of samples drawn and propagated at once. If
+                   None, samples are divided evenly among workers
+        processes: Number of worker processes. If 1 (default), chunks are
+                   computed in this process; if None, number of CPUs is used
+    Returns: summary
+        summary: Dictionary of statistics of the states at times. Keys are
+                 as follows
+            'times': Times (M)
+            'count': Number of samples
+            'mean': Mean of states (x,y,z,xd,yd,zd), (M,6)
+            'cov': Sample covariance of states, (M,6,6)
+            'min': Minimum of each component of states, (M,6)
+            'max': Maximum of each component of states, (M,6)
+    Exception:
+        ValueError: If shape of cov is inappropriate, raises ValueError
+        RuntimeError: If the orbit has not been defined, or it failed to
+                      the computation, raises RuntimeError
+    """
+    summary = None
+    for summary in dispersion_chunks(orbit, cov, times, nsamples, seed=seed,
+            chunksize=chunksize, processes=processes):
+        pass
+    return summary
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Streaming ephemerides of two-body orbits with pytwobodyorbit
+
+This module computes positions and velocities of one orbit (TwoBodyOrbit)
+or of many orbits (OrbitSet) at evenly spaced times, chunk by chunk, so
+that only one chunk is held in memory regardless of the total span.
+
+ephemeris_chunks() yields the chunks, and write_ephemeris() writes them
+into a preallocated memory-mapped file (.npy file, or raw binary file).
+Each record of the file is one time, with fields 't', 'pos', and 'vel'
+(see ephemeris_dtype()), so that chunks are written contiguously.
+
+@author: Shushi Uetsuki/whiskie14142
+"""
+
+import numpy as np
+from pytwobodyorbit import OrbitSet
+
+
+def _orbits(orbits):
+    """An OrbitSet, or a TwoBodyOrbit, and the number of members (0 for a
+    TwoBodyOrbit)"""
+    if isinstance(orbits, OrbitSet):
+        return orbits, len(orbits)
+    if hasattr(orbits, 'posvelatt'):
+        return orbits, 0
+    orbitset = OrbitSet(mu=orbits[0].mu)
+    orbitset.setOrbList(orbits)
+    return orbitset, len(orbitset)
+
+
+def _count(t1, t2, step):
+    """Number of times t1, t1 + step, ... not later than t2"""
+    if step <= 0.0:
+        raise(ValueError('step should be positive: ephemeris'))
+    if t2 < t1:
+        raise(ValueError('t2 should not be earlier than t1: ephemeris'))
+    # a time within round-off of t2 is included
+    return int(np.floor((t2 - t1) / step * (1.0 + 1e-12))) + 1
+
+
+def ephemeris_dtype(n=0):
+    """Returns dtype of records of ephemeris files
+
+    Args:
+        n: Number of orbits; 0 for a TwoBodyOrbit
+    Returns: dtype
+        dtype: Numpy dtype with fields 't' (time), 'pos' (position), and
+               'vel' (velocity); shapes of 'pos' and 'vel' are (3,), or
+               (n,3) for n orbits
+    """
+    shape = (3,) if n == 0 else (n, 3)
+    return np.dtype([('t', float), ('pos', float, shape),
+                     ('vel', float, shape)])
+
+
+def ephemeris_chunks(orbits, t1, t2, step, chunksize=65536):
+    """Generator of chunks of an ephemeris
+
+    Args:
+        orbits: TwoBodyOrbit instance, OrbitSet instance, or sequence of
+                TwoBodyOrbit instances (with the same gravitational
+                parameter)
+        t1: Start time
+        t2: End time; the last time is the latest of t1 + k * step not
+            later than t2
+        step: Interval of times
+        chunksize: Maximum number of states in a chunk (number of times
+                   multiplied by number of orbits); a chunk has
+                   max(1, chunksize // N) times for N orbits
+    Yields: times, pos, vel
+        times: Times of the chunk, Numpy array of M times
+        pos: Positions, (M,3) Numpy array for a TwoBodyOrbit, or (N,M,3)
+             for N orbits
+        vel: Velocities, same shape as pos
+    Exception:
+        ValueError: If step is not positive, or t2 is earlier than t1,
+                    raises ValueError
+        RuntimeError: If it failed to the computation, raises RuntimeError
+    """
+    orbits, n = _orbits(orbits)
+    count = _count(t1, t2, step)
+    # memory usage of a chunk is bounded by number of states, not of times
+    ntimes = max(1, chunksize // max(1, n))
+    for start in range(0, count, ntimes):
+        # times are computed from t1, so that errors do not accumulate
+        times = t1 + step * np.arange(start, min(start + ntimes, count),
+                                      dtype=float)
+        pos, vel = orbits.posvelatt(times)
+        yield times, pos, vel
+
+
+def write_ephemeris(filename, orbits, t1, t2, step, chunksize=65536,
+                    fmt='npy'):
+    """Writes an ephemeris into a memory-mapped file
+
+    The file is preallocated for all times, and chunks are written into it
+    one by one; peak memory usage is that of one chunk.
+    Args:
+        filename: Name of the file
+        orbits, t1, t2, step, chunksize: see ephemeris_chunks()
+        fmt: 'npy' for a .npy file (numpy.load(filename, mmap_mode='r')
+             reads it), or 'raw' for a raw binary file of records
+             (numpy.memmap(filename, dtype=ephemeris_dtype(n), mode='r')
+             reads it)
+    Returns: count
+        count: Number of records (times) written
+    Exception:
+        ValueError: If fmt is invalid, step is not positive, or t2 is
+                    earlier than t1, raises ValueError
+        RuntimeError: If it failed to the computation, raises RuntimeError
+    """
+    orbits, n = _orbits(orbits)
+    count = _count(t1, t2, step)
+    dtype = ephemeris_dtype(n)
+    if fmt == 'npy':
+        out = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                        shape=(count,))
+    elif fmt == 'raw':
+        out = np.memmap(filename, dtype=dtype, mode='w+', shape=(count,))
+    else:
+        raise(ValueError('Invalid fmt: ephemeris.write_ephemeris'))
+
+    start = 0
+    for times, pos, vel in ephemeris_chunks(orbits, t1, t2, step,
+                                            chunksize=chunksize):
+        chunk = out[start:start + times.shape[0]]
+        chunk['t'] = times
+        if n == 0:
+            chunk['pos'] = pos
+            chunk['vel'] = vel
+        else:
+            chunk['pos'] = pos.transpose(1, 0, 2)
+            chunk['vel'] = vel.transpose(1, 0, 2)
+        start += times.shape[0]
+        out.flush()
+    del out
+    return count
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Parallel propagation of many two-body orbits with pytwobodyorbit
+
+This module propagates many orbits around one central body in a pool of
+worker processes.  Orbits and times are partitioned into tiles (chunks of
+orbits times chunks of times); each tile is propagated by OrbitSet in a
+worker process.  Only Numpy arrays of epochs, positions, and velocities
+are sent to the workers (no pickled TwoBodyOrbit instances), and results
+are placed by the position of each tile, so that they do not depend on the
+number of processes or the order of completion.
+
+chunking() and map_chunks() are the process-pool helpers shared by this
+module, porkchop, and dispersion.
+
+@author: Shushi Uetsuki/whiskie14142
+"""
+
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pytwobodyorbit import OrbitSet
+from pytwobodyorbit import SolverStats
+from pytwobodyorbit import get_solver_stats
+
+
+def chunking(n, processes=1, chunksize=None):
+    """Number of worker processes and size of chunks for n items
+
+    Args:
+        n: Number of items
+        processes: Number of worker processes, or None for number of CPUs
+        chunksize: Number of items in a chunk. If None, items are divided
+                   evenly among workers
+    Returns: processes, chunksize
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, -(-n // processes))
+    return processes, chunksize
+
+
+def _recorded(func, *arg):
+    """Calls func(*arg) with a SolverStats activated in the worker process,
+    and returns the result and the SolverStats"""
+    with SolverStats() as stats:
+        result = func(*arg)
+    return result, stats
+
+
+def map_chunks(func, args, processes=1):
+    """Generator of func(*arg) for each tuple arg of args, in order of args
+
+    If processes is 1 or there is only one chunk, chunks are computed in
+    this process; otherwise in a pool of worker processes, and func and
+    the arguments should be picklable.  If a SolverStats instance is
+    activated, records of the worker processes are merged into it (its
+    callback is not called for them).
+    """
+    if processes == 1 or len(args) == 1:
+        for arg in args:
+            yield func(*arg)
+        return
+    stats = get_solver_stats()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        if stats is None:
+            for result in executor.map(func, *zip(*args)):
+                yield result
+            return
+        for result, worker_stats in executor.map(_recorded,
+                [func] * len(args), *zip(*args)):
+            stats.merge(worker_stats)
+            yield result
+
+
+def _propagate_tile(t0, pos, vel, mu, times):
+    """Propagates one tile; positions and velocities at times of the
+    orbits defined by (t0, pos, vel), (n,m,3) Numpy arrays"""
+    orbits = OrbitSet(mu=mu)
+    orbits.setOrbCart(t0, pos, vel)
+    return orbits.posvelatt(times)
+
+
+def _states(orbits):
+    """Epochs, positions, velocities, and mu of an OrbitSet or of a
+    sequence of TwoBodyOrbit instances (mu is None for an empty sequence)"""
+    if isinstance(orbits, OrbitSet):
+        if not orbits._setOrb:
+            raise(RuntimeError('Orbit has not been defined: parallel.propagate'))
+        return orbits.t0, orbits.pos, orbits.vel, orbits.mu
+    if len(orbits) == 0:
+        return np.empty(0), np.empty((0, 3)), np.empty((0, 3)), None
+    mu = orbits[0].mu
+    for orbit in orbits:
+        if not orbit._setOrb:
+            raise(RuntimeError('Orbit has not been defined: parallel.propagate'))
+        if orbit.mu != mu:
+            raise(ValueError('Inconsistent mu: parallel.propagate'))
+    return (np.array([orbit.t0 for orbit in orbits], dtype=float),
+            np.array([orbit.pos for orbit in orbits], dtype=float),
+            np.array([orbit.vel for orbit in orbits], dtype=float), mu)
+
+
+def propagate(orbits, times, processes=1, chunksize=None, timesize=None):
+    """Computes positions and velocities of many orbits at given times
+
+    Args:
+        orbits: OrbitSet instance, or sequence of N TwoBodyOrbit instances
+                (with the same gravitational parameter); N may be zero
+        times: Time, or 1-D array-like object of M times
+        processes: Number of worker processes. If 1 (default), tiles are
+                   computed in this process; if None, number of CPUs is used
+        chunksize: Number of orbits in a tile. If None, orbits are divided
+                   evenly among workers
+        timesize: Number of times in a tile. If None, all times are in one
+                  tile, unless there are fewer orbits than workers; then
+                  times are divided so that every worker has a tile
+    Returns: newpos, newvel
+        newpos: Positions, (N,3) Numpy array, or (N,M,3) for M times
+        newvel: Velocities, (N,3) Numpy array, or (N,M,3) for M times
+    Exception:
+        ValueError: If gravitational parameters of the orbits are
+                    different, raises ValueError
+        RuntimeError: If an orbit has not been defined, or it failed to the
+                      computation, raises RuntimeError
+    """
+    t0, pos, vel, mu = _states(orbits)
+    scalar = np.ndim(times) == 0
+    times = np.atleast_1d(np.asarray(times, dtype=float))
+    n = pos.shape[0]
+    m = times.shape[0]
+    if n == 0:
+        # as OrbitSet.posvelatt of no members
+        shape = (0, 3) if scalar else (0, m, 3)
+        return np.empty(shape), np.empty(shape)
+
+    processes, chunksize = chunking(n, processes, chunksize)
+    nchunk = -(-n // chunksize)
+    if timesize is None:
+        timesize = max(1, -(-m // max(1, -(-processes // nchunk))))
+    tiles = [(s, u) for s in range(0, n, chunksize)
+             for u in range(0, m, timesize)]
+    args = [(t0[s:s + chunksize], pos[s:s + chunksize],
+             vel[s:s + chunksize], mu, times[u:u + timesize])
+            for s, u in tiles]
+
+    results = map_chunks(_propagate_tile, args, processes)
+
+    newpos = np.empty((n, m, 3))
+    newvel = np.empty((n, m, 3))
+    for (s, u), (tpos, tvel) in zip(tiles, results):
+        newpos[s:s + chunksize, u:u + timesize] = tpos
+        newvel[s:s + chunksize, u:u + timesize] = tvel
+    if scalar:
+        return newpos[:, 0], newvel[:, 0]
+    return newpos, newvel
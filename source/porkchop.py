@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Porkchop plots (launch-window scans) with pytwobodyorbit
+
+This module computes grids of transfer orbits between two objects, which
+orbit around the same central body, for ranges of departure time and
+arrival time.  For each pair of departure and arrival time, it solves
+Lambert's problem and computes C3, v-infinity, and total delta-v.
+
+Ephemerides of the two objects are computed once for each departure time
+and each arrival time, and are reused across rows and columns of the grid.
+Rows of the grid can be distributed over a process pool, and each Lambert's
+problem is warm-started from a neighbouring solution of the grid.
+
+@author: Shushi Uetsuki/whiskie14142
+"""
+
+import numpy as np
+from pytwobodyorbit import lambert_batch
+from pytwobodyorbit import LAMBERT_OK
+from pytwobodyorbit import LAMBERT_NO_SOLUTION
+from parallel import chunking
+from parallel import map_chunks
+
+# Stride of the columns which seed warm-started Lambert's problems
+SEED_STRIDE = 8
+
+
+def _porkchop_rows(deppos, depvel, arrpos, arrvel, deptimes, arrtimes, mu,
+                   ccw, warm=True):
+    """Computes rows of a porkchop grid, one row for each departure time
+
+    Returns flight times, v-infinity at departure and at arrival, and status
+    codes, (nd,na) arrays.  If warm is True, problems are solved by Newton
+    steps seeded with z of neighbouring solutions, and only the problems
+    for which the steps fail are solved from scratch.
+    """
+    nd = deppos.shape[0]
+    na = arrpos.shape[0]
+    tof = arrtimes[None, :] - deptimes[:, None]
+    valid = tof > 0.0
+
+    ivel = np.full((nd, na, 3), np.nan)
+    tvel = np.full((nd, na, 3), np.nan)
+    status = np.full((nd, na), LAMBERT_NO_SOLUTION)
+    ipos = np.broadcast_to(deppos[:, None, :], (nd, na, 3))
+    tpos = np.broadcast_to(arrpos[None, :, :], (nd, na, 3))
+    cold = valid
+    if warm:
+        # every SEED_STRIDE-th column is started from z = 0 (parabola), and
+        # the other columns are seeded from the nearest one of them
+        zn = np.full((nd, na), np.nan)
+        coarse = np.zeros((nd, na), dtype=bool)
+        coarse[:, ::SEED_STRIDE] = True
+        nearest = np.minimum((np.arange(na) + SEED_STRIDE // 2) \
+            // SEED_STRIDE * SEED_STRIDE, (na - 1) // SEED_STRIDE * SEED_STRIDE)
+        for cells in (valid & coarse, valid & ~coarse):
+            if cells.any():
+                z0 = zn[:, nearest][cells]
+                ivel[cells], tvel[cells], status[cells], zn[cells] = \
+                    lambert_batch(ipos[cells], tpos[cells], tof[cells],
+                    mu=mu, ccw=ccw, z0=np.where(np.isnan(z0), 0.0, z0),
+                    full_output=True, fallback=False)
+        # problems for which Newton steps failed are solved from scratch
+        cold = valid & (status != LAMBERT_OK)
+    if cold.any():
+        ivel[cold], tvel[cold], status[cold] = lambert_batch(ipos[cold],
+            tpos[cold], tof[cold], mu=mu, ccw=ccw)
+
+    vinf_dep = np.sqrt(np.sum((ivel - depvel[:, None, :]) ** 2, axis=2))
+    vinf_arr = np.sqrt(np.sum((tvel - arrvel[None, :, :]) ** 2, axis=2))
+    return tof, vinf_dep, vinf_arr, status
+
+
+def porkchop(deporb, arrorb, deptimes, arrtimes, ccw=True, processes=1,
+             chunksize=None, warm=True):
+    """Computes porkchop grids of transfer orbits between two objects
+
+    Args:
+        deporb: TwoBodyOrbit instance of the departure object
+        arrorb: TwoBodyOrbit instance of the arrival object
+            Both objects should orbit around the same central body (mu)
+        deptimes: Array-like object of M departure times
+        arrtimes: Array-like object of K arrival times
+        ccw: Flag for orbital direction of transfer orbits. If True,
+             counter clockwise
+        processes: Number of worker processes. If 1 (default), the grid is
+                   computed in this process; if None, number of CPUs is used
+        chunksize: Number of departure times (rows) in a chunk for a worker
+                   process. If None, rows are divided evenly among workers
+        warm: If True (default), Lambert's problems are seeded with
+              solutions of neighbouring arrival times, and solved by a few
+              Newton steps. If False, every problem is solved from scratch
+    Returns: grid
+        grid: Dictionary of Numpy arrays. Keys are as follows
+            'deptimes': Departure times (M)
+            'arrtimes': Arrival times (K)
+            'tof': Flight times (M,K)
+            'c3': Characteristic energy at departure (M,K)
+            'vinf_dep': Hyperbolic excess speed at departure (M,K)
+            'vinf_arr': Hyperbolic excess speed at arrival (M,K)
+            'dv': Total delta-v, sum of vinf_dep and vinf_arr (M,K)
+            'status': Status code of lambert_batch (M,K)
+
+            Elements for which the transfer orbit could not be computed
+            (including non-positive flight time) are nan.
+    Exception:
+        ValueError: If gravitational parameters of the two objects are
+                    different, raises ValueError
+    """
+    if deporb.mu != arrorb.mu:
+        raise(ValueError('Central bodies of the objects are different: ' +
+                         'porkchop.porkchop'))
+    mu = deporb.mu
+    deptimes = np.atleast_1d(np.asarray(deptimes, dtype=float))
+    arrtimes = np.atleast_1d(np.asarray(arrtimes, dtype=float))
+
+    # ephemerides of the objects are computed once for the whole grid
+    deppos, depvel = deporb.posvelatt(deptimes)
+    arrpos, arrvel = arrorb.posvelatt(arrtimes)
+
+    nd = deptimes.shape[0]
+    processes, chunksize = chunking(nd, processes, chunksize)
+    starts = list(range(0, nd, chunksize))
+    chunks = [(deppos[s:s + chunksize], depvel[s:s + chunksize], arrpos,
+               arrvel, deptimes[s:s + chunksize], arrtimes, mu, ccw, warm)
+              for s in starts]
+
+    results = list(map_chunks(_porkchop_rows, chunks, processes))
+
+    tof = np.concatenate([res[0] for res in results])
+    vinf_dep = np.concatenate([res[1] for res in results])
+    vinf_arr = np.concatenate([res[2] for res in results])
+    status = np.concatenate([res[3] for res in results])
+    failed = status != LAMBERT_OK
+    vinf_dep[failed] = np.nan
+    vinf_arr[failed] = np.nan
+
+    grid = {'deptimes':deptimes,
+        'arrtimes':arrtimes,
+        'tof':tof,
+        'c3':vinf_dep ** 2,
+        'vinf_dep':vinf_dep,
+        'vinf_arr':vinf_arr,
+        'dv':vinf_dep + vinf_arr,
+        'status':status}
+    return grid
@@ -5,18 +5,1163 @@ This module provide computations about two-body orbits, including:
   Define the orbit by position and velocity of an object
   Define the orbit by classical orbital elements of an object
   Compute position and velocity of an object at given time
+  Compute state transition matrix of an object at given time
+  Compute times of events (apsides, nodes, and crossings of a radius)
   Provide seriese of points on orbital trajectory for visualization
   Solve Lambert's problem  (From given two positions and flight time 
   between them, lambert() computes initial and terminal velocity of 
   the object)
+  Propagate a set of many orbits at once (OrbitSet)
+  Convert arrays of states into classical orbital elements, and back
+  Share an immutable orbit among threads (FrozenOrbit)
+  Record iterations and timing of the solvers (SolverStats)
 
 @author: Shushi Uetsuki/whiskie14142
 """
 
 import numpy as np
 import math
-from scipy.optimize import newton
-from scipy.optimize import bisect
+import time
+from collections import OrderedDict
+
+# scipy.optimize is imported where a root finder is needed, so that
+# importing this module and element conversions do not load SciPy
+
+
+class SolverStats:
+    """Statistics of the solvers of Kepler's equation and Lambert's problem
+    
+    Statistics are recorded only while an instance is activated, either by
+    set_solver_stats(), or by a 'with' statement:
+    
+        with SolverStats() as stats:
+            orbit.posvelatt(t)
+        print(stats.summary())
+    
+    When no instance is activated, the solvers skip recording entirely.
+    Records are aggregated for each solver name:
+        'posvelatt.anomaly': posvelatt by eccentric or hyperbolic anomaly
+        'posvelatt.universal': posvelatt by universal variable
+        'stmatt': stmatt
+        'lambert': lambert
+        'lambert_batch': lambert_batch
+        'lambert_multirev': lambert_multirev
+        'orbitset': posvelatt, stmatt, and covarianceatt of OrbitSet (one
+                    record for each chunk of covarianceatt)
+    For calls with arrays, iterations are counted once per vectorized
+    iteration, and function evaluations are counted for each element.
+    
+    The activated instance is global to the process: it records calls of
+    all threads, and it is not thread-safe (records of concurrent calls may
+    be lost).  Worker processes do not share it; propagate, porkchop, and
+    dispersion with processes > 1 record in each worker and merge the
+    records into the activated instance with merge().
+    """
+    def __init__(self, callback=None):
+        """
+        Args:
+            callback: Function called for every record (optional) as
+                      callback(name, record), where record is a dictionary
+                      with keys 'iterations', 'fevals', 'fallbacks', and
+                      'elapsed'
+        """
+        self.callback = callback
+        self._previous = None
+        self.reset()
+    
+    def reset(self):
+        """Discards all records"""
+        self.totals = {}
+    
+    def record(self, name, iterations=0, fevals=0, fallbacks=0, elapsed=0.0):
+        """Records one call of a solver
+        
+        Args:
+            name: Name of the solver
+            iterations: Number of iterations
+            fevals: Number of evaluations of the function to be solved
+            fallbacks: Number of fallbacks to bracketing and bisection
+            elapsed: Wall time of the call in seconds
+        """
+        tot = self.totals.get(name)
+        if tot is None:
+            tot = {'calls':0, 'iterations':0, 'max_iterations':0, 'fevals':0,
+                   'fallbacks':0, 'elapsed':0.0}
+            self.totals[name] = tot
+        tot['calls'] += 1
+        tot['iterations'] += iterations
+        tot['max_iterations'] = max(tot['max_iterations'], iterations)
+        tot['fevals'] += fevals
+        tot['fallbacks'] += fallbacks
+        tot['elapsed'] += elapsed
+        if self.callback is not None:
+            self.callback(name, {'iterations':iterations, 'fevals':fevals,
+                                 'fallbacks':fallbacks, 'elapsed':elapsed})
+    
+    def merge(self, other):
+        """Adds records of another SolverStats (e.g. from other processes)"""
+        for name, oth in other.totals.items():
+            tot = self.totals.get(name)
+            if tot is None:
+                self.totals[name] = dict(oth)
+                continue
+            for key in ('calls', 'iterations', 'fevals', 'fallbacks',
+                        'elapsed'):
+                tot[key] += oth[key]
+            tot['max_iterations'] = max(tot['max_iterations'],
+                                        oth['max_iterations'])
+    
+    def summary(self):
+        """Returns the totals with mean values per call
+        
+        Returns:
+            summary: Dictionary keyed by solver name. Each value is a
+                dictionary of totals ('calls', 'iterations',
+                'max_iterations', 'fevals', 'fallbacks', 'elapsed') and
+                means ('mean_iterations', 'mean_fevals', 'mean_elapsed')
+        """
+        summary = {}
+        for name, tot in self.totals.items():
+            item = dict(tot)
+            item['mean_iterations'] = tot['iterations'] / tot['calls']
+            item['mean_fevals'] = tot['fevals'] / tot['calls']
+            item['mean_elapsed'] = tot['elapsed'] / tot['calls']
+            summary[name] = item
+        return summary
+    
+    def __enter__(self):
+        self._previous = set_solver_stats(self)
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        set_solver_stats(self._previous)
+        self._previous = None
+        return False
+
+
+# SolverStats instance which records statistics, or None (disabled)
+_stats = None
+
+
+def set_solver_stats(stats):
+    """Activates a SolverStats instance, or disables recording with None
+    
+    Returns:
+        previous: SolverStats instance activated before, or None
+    """
+    global _stats
+    previous = _stats
+    _stats = stats
+    return previous
+
+
+def get_solver_stats():
+    """Returns the activated SolverStats instance, or None"""
+    return _stats
+
+
+# orbits with |1 - e| below this are near-parabolic for the 'anomaly' solver
+# of TwoBodyOrbit
+_NEAR_PARABOLIC = 0.01
+
+# coefficients of series of the Stumpff functions, 1/(2n+2)! and 1/(2n+3)!
+_STUMPFF_C = [1.0 / math.factorial(2 * n + 2) for n in range(9)]
+_STUMPFF_S = [1.0 / math.factorial(2 * n + 3) for n in range(9)]
+
+
+def _stumpff(z):
+    """Stumpff functions C(z) and S(z) for a float or an array of z
+    
+    Series are used for |z| < 1, where the closed forms lose precision by
+    cancellation (and cannot be evaluated at z == 0).  A float is computed
+    with the math module; for an array, Numpy arrays are returned.
+    Returns: cz, sz
+    """
+    if isinstance(z, float):
+        if abs(z) < 1.0:
+            return _stumpff_series(z)
+        try:
+            if z > 0.0:
+                sqz = math.sqrt(z)
+                return (1.0 - math.cos(sqz)) / z, (sqz - math.sin(sqz)) \
+                    / sqz ** 3
+            sqz = math.sqrt((-1.0) * z)
+            return (1.0 - math.cosh(sqz)) / z, (math.sinh(sqz) - sqz) \
+                / sqz ** 3
+        except OverflowError:
+            return math.inf, math.inf
+    
+    z = np.asarray(z, dtype=float)
+    small = np.abs(z) < 1.0
+    if small.all():
+        return _stumpff_series(z)
+    if not small.any():
+        return _stumpff_closed(z)
+    cz = np.empty(z.shape)
+    sz = np.empty(z.shape)
+    cz[small], sz[small] = _stumpff_series(z[small])
+    large = ~small
+    cz[large], sz[large] = _stumpff_closed(z[large])
+    return cz, sz
+
+
+def _stumpff_series(z):
+    """Stumpff functions C(z) and S(z) by series, for a float or an array of
+    |z| < 1"""
+    cz = _STUMPFF_C[-1]
+    sz = _STUMPFF_S[-1]
+    for n in range(len(_STUMPFF_C) - 2, -1, -1):
+        cz = _STUMPFF_C[n] - z * cz
+        sz = _STUMPFF_S[n] - z * sz
+    return cz, sz
+
+
+def _stumpff_closed(z):
+    """Stumpff functions C(z) and S(z) by closed forms, for an array of
+    |z| >= 1"""
+    cz = np.empty(z.shape)
+    sz = np.empty(z.shape)
+    neg = z < 0.0
+    pos = ~neg
+    zn = z[neg]
+    sqz = np.sqrt((-1.0) * zn)
+    with np.errstate(over='ignore', invalid='ignore'):
+        cz[neg] = (1.0 - np.cosh(sqz)) / zn
+        sz[neg] = (np.sinh(sqz) - sqz) / sqz ** 3
+    zp = z[pos]
+    sqz = np.sqrt(zp)
+    cz[pos] = (1.0 - np.cos(sqz)) / zp
+    sz[pos] = (sqz - np.sin(sqz)) / sqz ** 3
+    return cz, sz
+
+
+def _universal_anomaly(delta_t, sr, rdotv, a, mu, tol=1.48e-8, maxiter=50,
+                       info=None, x0=None):
+    """Solves the universal-variable Kepler equation for arrays of time
+    
+    All arguments are broadcast against each other, so that one orbit can
+    be solved for many times, or many orbits for one time.
+    
+    Args:
+        delta_t: Time from epoch
+        sr: Distance from the central body at epoch
+        rdotv: Dot product of position and velocity at epoch
+        a: Semi-major axis
+        mu: Gravitational parameter of the central body
+        tol: Tolerance of Newton iteration (same as scipy.optimize.newton)
+        maxiter: Maximum number of Newton iterations
+        info: Dictionary (optional); 'iterations', 'fevals', and 'fallbacks'
+              (number of elements solved by bisection) are set
+        x0: Initial guess (optional); sqrt(mu) * delta_t / a by default
+    Returns: xn
+        xn: Universal anomaly (Numpy array)
+    Exception:
+        RuntimeError: If the equation could not be solved for some elements,
+                      raises RuntimeError
+    """
+    delta_t, sr, rdotv, a = np.broadcast_arrays(
+        np.asarray(delta_t, dtype=float), np.asarray(sr, dtype=float),
+        np.asarray(rdotv, dtype=float), np.asarray(a, dtype=float))
+    sqmu = np.sqrt(mu)
+    sigma = rdotv / sqmu
+    
+    def _func(xn, dt, sr, sigma, a):
+        z = xn * xn / a
+        cz, sz = _stumpff(z)
+        return (sigma * xn * xn * cz + (1.0 - sr / a) * xn ** 3 * sz + sr \
+            * xn) / sqmu - dt
+    
+    def _fprime(x, sr, sigma, a):
+        z = x * x / a
+        cz, sz = _stumpff(z)
+        return (x * x * cz + sigma * x * (1.0 - z * sz) + sr * (1.0 - z \
+            * cz)) / sqmu
+
+    # np.array keeps 0-d input as an array, so that xn.flat can be updated
+    if x0 is None:
+        x0 = sqmu * delta_t / a
+    x0 = np.array(np.broadcast_to(x0, delta_t.shape), dtype=float)
+    xn = x0.copy()
+    
+    # Newton iteration on all elements which have not converged yet
+    active = np.flatnonzero(delta_t != 0.0)
+    failed = []
+    niter = 0
+    nfev = 0
+    for i in range(maxiter):
+        if active.size == 0:
+            break
+        niter += 1
+        nfev += active.size
+        xa = xn.flat[active]
+        sra = sr.flat[active]
+        sga = sigma.flat[active]
+        aa = a.flat[active]
+        with np.errstate(all='ignore'):
+            fval = _func(xa, delta_t.flat[active], sra, sga, aa)
+            fder = _fprime(xa, sra, sga, aa)
+            xnew = xa - fval / fder
+        ok = np.isfinite(xnew) & (fder != 0.0)
+        done = ok & (np.abs(xnew - xa) < tol)
+        xn.flat[active[ok]] = xnew[ok]
+        failed.append(active[~ok])
+        active = active[ok & ~done]
+
+    # elements which failed or did not converge are solved by bisection
+    failed.append(active)
+    failed = np.concatenate(failed)
+    if failed.size:
+        nfev += _bisect_universal(xn, failed, x0, delta_t, sr, sigma, a,
+            _func)
+    if info is not None:
+        info['iterations'] = niter
+        info['fevals'] = nfev
+        info['fallbacks'] = failed.size
+    return xn
+
+
+def _bisect_universal(xn, idx, x0, delta_t, sr, sigma, a, func, maxiter=200):
+    """Bisection fallback of _universal_anomaly for elements in idx
+    
+    Boundaries are searched by decade steps from x0, as the scalar
+    TwoBodyOrbit.posvelatt does, and xn is updated in place.  Returns
+    number of function evaluations.
+    """
+    x0 = x0.flat[idx]
+    dt = delta_t.flat[idx]
+    sr = sr.flat[idx]
+    sigma = sigma.flat[idx]
+    a = a.flat[idx]
+    with np.errstate(all='ignore'):
+        f0 = func(x0, dt, sr, sigma, a)
+    
+    # Configure boundaries
+    # b1: Lower boundary
+    # b2: Upper boundary
+    nfev = x0.size
+    b1 = x0.copy()
+    b2 = x0.copy()
+    found = np.zeros(x0.shape, dtype=bool)
+    upward = f0 < 0.0
+    for i in range(50):
+        if found.all():
+            break
+        nfev += x0.size
+        x1 = np.where(upward, x0 + 10.0 ** (i + 1), x0 - 10.0 ** (i + 1))
+        with np.errstate(all='ignore'):
+            test = func(x1, dt, sr, sigma, a)
+        hit = ~found & np.where(upward, test > 0.0, test < 0.0)
+        b2[hit & upward] = x1[hit & upward]
+        b1[hit & ~upward] = x1[hit & ~upward]
+        found |= hit
+    if not found.all():
+        raise(RuntimeError('Could not compute position and ' +
+            'velocity: TwoBodyOrbit.posvelatt'))
+
+    # bisection with the tolerances of scipy.optimize.bisect
+    with np.errstate(all='ignore'):
+        f1 = func(b1, dt, sr, sigma, a)
+    for i in range(maxiter):
+        xm = (b1 + b2) / 2.0
+        with np.errstate(all='ignore'):
+            fm = func(xm, dt, sr, sigma, a)
+        same = np.sign(fm) == np.sign(f1)
+        b1 = np.where(same, xm, b1)
+        f1 = np.where(same, fm, f1)
+        b2 = np.where(same, b2, xm)
+        if np.all(np.abs(b2 - b1) < 2e-12 + 8.881784197001252e-16 * np.abs(xm)):
+            break
+    xn.flat[idx] = (b1 + b2) / 2.0
+    return nfev + (i + 2) * x0.size
+
+
+def _posvel_universal(pos, vel, delta_t, xn, a, mu):
+    """Position and velocity from universal anomaly by f and g functions
+    
+    pos and vel are (...,3) arrays at epoch; delta_t and xn are broadcast
+    against their leading dimensions.
+    """
+    sr = np.sqrt(np.sum(pos * pos, axis=-1))
+    sqmu = np.sqrt(mu)
+    z = xn * xn / a
+    cz, sz = _stumpff(z)
+    val_f = 1.0 - xn * xn / sr * cz
+    val_g = delta_t - xn ** 3 / sqmu * sz
+    newpos = pos * val_f[..., None] + vel * val_g[..., None]
+    newr = np.sqrt(np.sum(newpos * newpos, axis=-1))
+    val_fd = sqmu / sr / newr * xn * (z * sz - 1.0)
+    val_gd = 1.0 - xn * xn / newr * cz
+    newvel = pos * val_fd[..., None] + vel * val_gd[..., None]
+    return newpos, newvel
+
+
+def _stumpff_array(z):
+    """Stumpff functions c2(z), c3(z), c4(z), and c5(z) for an array of z
+    
+    c2 and c3 are computed by _stumpff; series are used for c4 and c5 for
+    |z| < 1, where the closed forms cancel.
+    """
+    z = np.asarray(z, dtype=float)
+    small = np.abs(z) < 1.0
+    c2, c3 = _stumpff(z)
+    
+    # c_k(z) = sum((-z)**n / (2*n+k)!) by Horner's method
+    series = [np.zeros(z.shape) for k in range(2)]
+    for n in range(12, -1, -1):
+        for k in range(2):
+            series[k] = 1.0 / math.factorial(2 * n + k + 4) - z * series[k]
+    
+    zd = np.where(small, 1.0, z)
+    with np.errstate(all='ignore'):
+        c4 = (0.5 - c2) / zd
+        c5 = (1.0 / 6.0 - c3) / zd
+    return (c2, c3, np.where(small, series[0], c4),
+            np.where(small, series[1], c5))
+
+
+def _stm_universal(pos, vel, delta_t, xn, a, mu):
+    """Position, velocity, and state transition matrix from universal anomaly
+    
+    pos and vel are (...,3) arrays at epoch; delta_t and xn are broadcast
+    against their leading dimensions, as _posvel_universal. The state
+    transition matrix is returned as a (...,6,6) array.
+    
+    Position and velocity are F*pos + G*vel and Ft*pos + Gt*vel, where the
+    Lagrange coefficients are functions of distance (sr), sigma (dot
+    product of position and velocity divided by sqrt(mu)), and alpha (1/a)
+    at epoch, and of universal anomaly.  Universal anomaly depends on them
+    through Kepler's equation
+        sqrt(mu) * delta_t = sr * U1 + sigma * U2 + U3,
+    whose derivative by universal anomaly is the distance at t.  Partial
+    derivatives by (sr, sigma, alpha) are obtained with the universal
+    functions U0 to U5, and are chained to derivatives by pos and vel.
+    """
+    sqmu = np.sqrt(mu)
+    sr = np.sqrt(np.sum(pos * pos, axis=-1))
+    sigma = np.sum(pos * vel, axis=-1) / sqmu
+    alpha = 1.0 / np.asarray(a, dtype=float)
+    x = xn
+    c2, c3, c4, c5 = _stumpff_array(alpha * x * x)
+    
+    # universal functions
+    u2 = x * x * c2
+    u3 = x ** 3 * c3
+    u4 = x ** 4 * c4
+    u5 = x ** 5 * c5
+    u1 = x - alpha * u3
+    u0 = 1.0 - alpha * u2
+    newr = sr * u0 + sigma * u1 + u2
+    
+    # Lagrange coefficients
+    val_f = 1.0 - u2 / sr
+    val_g = (sr * u1 + sigma * u2) / sqmu
+    val_fd = (-1.0) * sqmu * u1 / newr / sr
+    val_gd = 1.0 - u2 / newr
+    newpos = pos * val_f[..., None] + vel * val_g[..., None]
+    newvel = pos * val_fd[..., None] + vel * val_gd[..., None]
+    
+    # derivatives of universal anomaly by (sr, sigma, alpha)
+    dkep = np.stack(np.broadcast_arrays(u1, u2, (sr * (u3 - x * u2)
+        + sigma * (2.0 * u4 - x * u3) + 3.0 * u5 - x * u4) / 2.0), axis=-1)
+    dx = (-1.0) * dkep / newr[..., None]
+    
+    # total derivatives of universal functions by (sr, sigma, alpha)
+    du0 = (-1.0) * alpha[..., None] * u1[..., None] * dx
+    du1 = u0[..., None] * dx
+    du2 = u1[..., None] * dx
+    du0[..., 2] += (-0.5) * x * u1
+    du1[..., 2] += (u3 - x * u2) / 2.0
+    du2[..., 2] += (2.0 * u4 - x * u3) / 2.0
+    
+    # total derivatives of Lagrange coefficients by (sr, sigma, alpha)
+    dr = sr[..., None] * du0 + sigma[..., None] * du1 + du2
+    dr[..., 0] += u0
+    dr[..., 1] += u1
+    df = (-1.0) * du2 / sr[..., None]
+    df[..., 0] += u2 / sr / sr
+    dg = sr[..., None] * du1 + sigma[..., None] * du2
+    dg[..., 0] += u1
+    dg[..., 1] += u2
+    dg /= sqmu
+    dfd = (-1.0) * sqmu * (du1 / (newr * sr)[..., None] - (u1 / newr / newr
+        / sr)[..., None] * dr)
+    dfd[..., 0] += sqmu * u1 / newr / sr / sr
+    dgd = (-1.0) * du2 / newr[..., None] + (u2 / newr / newr)[..., None] \
+        * dr
+    
+    # derivatives of (sr, sigma, alpha) by pos and vel, (...,3,6)
+    zero = np.zeros(np.shape(vel))
+    jac = np.stack((np.concatenate((pos / sr[..., None], zero), axis=-1),
+        np.concatenate((vel, pos), axis=-1) / sqmu,
+        np.concatenate(((-2.0) * pos / sr[..., None] ** 3,
+        (-2.0) * vel / mu), axis=-1)), axis=-2)
+    grads = np.stack((df, dg, dfd, dgd), axis=-2) @ jac
+    
+    shape = np.broadcast_shapes(np.shape(pos)[:-1], np.shape(x))
+    stm = np.empty(shape + (6, 6))
+    stm[..., :3, :] = pos[..., :, None] * grads[..., 0, None, :] \
+        + vel[..., :, None] * grads[..., 1, None, :]
+    stm[..., 3:, :] = pos[..., :, None] * grads[..., 2, None, :] \
+        + vel[..., :, None] * grads[..., 3, None, :]
+    eye = np.eye(3)
+    stm[..., :3, :3] += val_f[..., None, None] * eye
+    stm[..., :3, 3:] += val_g[..., None, None] * eye
+    stm[..., 3:, :3] += val_fd[..., None, None] * eye
+    stm[..., 3:, 3:] += val_gd[..., None, None] * eye
+    return newpos, newvel, stm
+
+
+def _time_from_peri(ta, a, e, mu):
+    """Time from periapsis passage for arrays of true anomaly
+    
+    Vectorized counterpart of TwoBodyOrbit.timeFperi; ta, a, and e are
+    broadcast against each other.  e should not be 1.0.
+    """
+    ta, a, e = np.broadcast_arrays(np.asarray(ta, dtype=float),
+        np.asarray(a, dtype=float), np.asarray(e, dtype=float))
+    sec_from_peri = np.empty(ta.shape)
+    with np.errstate(all='ignore'):
+        r = a * (1.0 - e ** 2) / (1.0 + e * np.cos(ta))
+        ell = e < 1.0
+        b_over_a = np.sqrt(1.0 - e[ell] ** 2)
+        ecc_anm = np.arctan2(r[ell] * np.sin(ta[ell]) / b_over_a, a[ell] \
+            * e[ell] + r[ell] * np.cos(ta[ell]))
+        ecc_anm = np.where(ecc_anm < 0.0, ecc_anm + math.pi * 2.0, ecc_anm)
+        sec_from_peri[ell] = np.sqrt(a[ell] ** 3 / mu) * (ecc_anm - e[ell] \
+            * np.sin(ecc_anm))
+        hyp = ~ell
+        tah = ta[hyp]
+        eh = e[hyp]
+        sy = (eh + np.cos(tah)) / (1.0 + eh * np.cos(tah))
+        lf = np.log(sy + np.sqrt(sy ** 2 - 1.0))
+        lf = np.where((tah < 0.0) | (tah > math.pi), (-1.0) * lf, lf)
+        sec_from_peri[hyp] = np.sqrt((-1.0) * a[hyp] ** 3 / mu) * (eh \
+            * np.sinh(lf) - lf)
+    return sec_from_peri
+
+
+def _time_from_peri_scalar(ta, a, e, p, mu):
+    """Time from periapsis passage for a float true anomaly, with the math
+    module; scalar counterpart of _time_from_peri (e may be 1.0)"""
+    r = a * (1.0 - e ** 2) / (1.0 + e * math.cos(ta))
+    if e < 1.0:
+        b_over_a = math.sqrt(1.0 - e ** 2)
+        ecc_anm = math.atan2(r * math.sin(ta) / b_over_a, a * e \
+            + r * math.cos(ta))
+        if ecc_anm < 0.0: ecc_anm += math.pi * 2.0
+        sec_from_peri = math.sqrt(a **3 / mu) * (ecc_anm \
+            - e * math.sin(ecc_anm))
+    elif e == 1.0:
+        ecc_anm = math.sqrt(p) * math.tan(ta / 2.0)
+        sec_from_peri = (p * ecc_anm + ecc_anm ** 3 / 3.0) / 2.0 / \
+            math.sqrt(mu)
+    else:
+        sy = (e + math.cos(ta)) / (1.0 + e * math.cos(ta))
+        # ta beyond the asymptotes yields nan, as Numpy does
+        d = sy ** 2 - 1.0
+        lf = math.log(sy + math.sqrt(d)) if d >= 0.0 and sy > 0.0 \
+            else math.nan
+        if (ta < 0.0) or (ta > math.pi): lf = lf * (-1.0)
+        sec_from_peri = math.sqrt((-1.0) * a ** 3 / mu) \
+            * (e * math.sinh(lf) - lf)
+    return sec_from_peri
+
+
+def _ta_at_epoch(epoch, T, a, e, mu):
+    """True anomaly at epoch in (-pi, pi], from periapsis passage time T"""
+    ta = float(_true_anomaly(math.sqrt(mu / abs(a) ** 3) * (epoch - T), e))
+    if ta > math.pi:
+        ta -= math.pi * 2.0
+    return ta
+
+
+def _basis(evd, hv):
+    """Unit vectors of the perifocal frame (P, Q) as tuples of floats, from
+    the normalized eccentricity vector and the angular momentum vector"""
+    PVt = tuple(float(c) for c in evd)
+    hv = tuple(float(c) for c in hv)
+    hlen = math.sqrt(_dot3(hv, hv))
+    return PVt, tuple(c / hlen for c in _cross3(hv, PVt))
+
+
+def _posvel_ta_scalar(ta, PVt, QVt, p, e, mu):
+    """Position and velocity for a float true anomaly, with the math
+    module; scalar counterpart of _posvel_ta"""
+    px, py, pz = PVt
+    qx, qy, qz = QVt
+    ct = math.cos(ta)
+    st = math.sin(ta)
+    r = p / (1.0 + e * ct)
+    xp = r * ct
+    yp = r * st
+    vf = math.sqrt(mu / p)
+    vxp = (-1.0) * st
+    vyp = e + ct
+    rv = np.array([xp * px + yp * qx, xp * py + yp * qy, xp * pz + yp * qz])
+    vv = np.array([vf * (vxp * px + vyp * qx), vf * (vxp * py + vyp * qy),
+        vf * (vxp * pz + vyp * qz)])
+    return rv, vv
+
+
+def _posvel_ta(ta, PV, QV, p, e, mu):
+    """Position and velocity for arrays of true anomaly
+    
+    Vectorized counterpart of TwoBodyOrbit.posvel.  PV and QV are (...,3)
+    unit vectors of the perifocal frame; ta, p, and e are broadcast against
+    their leading dimensions.
+    """
+    ta = np.asarray(ta, dtype=float)
+    cta = np.cos(ta)[..., None]
+    sta = np.sin(ta)[..., None]
+    p = np.asarray(p, dtype=float)[..., None]
+    e = np.asarray(e, dtype=float)[..., None]
+    r = p / (1.0 + e * cta)
+    rv = r * cta * PV + r * sta * QV
+    vv = np.sqrt(mu / p) * ((-1.0) * sta * PV + (e + cta) * QV)
+    return rv, vv
+
+
+def _event_anomalies(kind, e, p, parg, i, radius=None):
+    """True anomalies of events for arrays of orbital elements
+    
+    Returns a list of arrays of true anomalies in (-pi, pi], one array for
+    each branch of the event; elements are nan for orbits which do not
+    have the event.
+    """
+    e = np.asarray(e, dtype=float)
+    nan = np.full(e.shape, np.nan)
+    with np.errstate(all='ignore'):
+        if kind == 'periapsis':
+            tas = [np.zeros(e.shape)]
+        elif kind == 'apoapsis':
+            tas = [np.where(e < 1.0, math.pi, nan)]
+        elif kind in ('ascending', 'descending'):
+            # nodes of equatorial orbits are undefined
+            noded = np.sin(i) > 1e-12
+            tas = [np.where(noded, (-1.0) * parg if kind == 'ascending' else
+                math.pi - parg, nan)]
+        elif kind in ('radius', 'radius_out', 'radius_in'):
+            if radius is None:
+                raise(ValueError('radius is required for radius events'))
+            ta = np.arccos((p / radius - 1.0) / e)
+            tas = {'radius':[ta, np.where((ta > 0.0) & (ta < math.pi),
+                (-1.0) * ta, nan)], 'radius_out':[ta],
+                'radius_in':[(-1.0) * ta]}[kind]
+        else:
+            raise(ValueError('Invalid kind of event: ' + str(kind)))
+        
+        result = []
+        for ta in tas:
+            ta = np.arctan2(np.sin(ta), np.cos(ta)) + np.zeros(e.shape)
+            # hyperbolic trajectories are limited by the asymptotes
+            result.append(np.where((e < 1.0) | (np.cos(ta) > -1.0 / e), ta,
+                nan))
+    return result
+
+
+def _event_times(ta, T, pr, a, e, mu, t1, t2):
+    """Times of true anomalies ta between t1 and t2 for arrays of orbits
+    
+    Elliptic orbits pass ta once per period, and hyperbolic trajectories
+    at most once.  Returns indices of orbits and times of the passages,
+    as Numpy arrays.
+    """
+    ta, T, pr, a, e = np.broadcast_arrays(np.asarray(ta, dtype=float),
+        np.asarray(T, dtype=float), np.asarray(pr, dtype=float),
+        np.asarray(a, dtype=float), np.asarray(e, dtype=float))
+    ok = np.isfinite(ta)
+    ell = e < 1.0
+    base = T + _time_from_peri(np.where(ok, ta, 0.0), a, e, mu)
+    with np.errstate(invalid='ignore'):
+        kmin = np.where(ell & ok, np.ceil((t1 - base) / pr), 0.0)
+        kmax = np.where(ell & ok, np.floor((t2 - base) / pr), np.where(ok
+            & (base >= t1) & (base <= t2), 0.0, -1.0))
+    counts = np.maximum(kmax - kmin + 1.0, 0.0).astype(int)
+    index = np.repeat(np.arange(ta.size), counts.ravel())
+    offsets = np.cumsum(counts.ravel()) - counts.ravel()
+    k = kmin.ravel()[index] + (np.arange(index.size) - offsets[index])
+    times = base.ravel()[index] + k * np.where(ell, pr, 0.0).ravel()[index]
+    return index, times
+
+
+def _cart_elements(t, pos, vel, mu, caller):
+    """Orbital elements for arrays of epochs, positions, and velocities
+    
+    Returns a dictionary of Numpy arrays, with the same keys as names of
+    array attributes of OrbitSet.  caller is used in error messages.
+    """
+    pos = np.array(pos, dtype=float).reshape(-1, 3)
+    vel = np.array(vel, dtype=float).reshape(-1, 3)
+    if pos.shape != vel.shape:
+        raise(ValueError('Shapes of pos and vel do not match in ' + caller))
+    n = pos.shape[0]
+    
+    # Computes Classical orbital elements
+    r0len = np.sqrt(np.sum(pos * pos, axis=1))
+    rd0len2 = np.sum(vel * vel, axis=1)
+    h = np.cross(pos, vel)
+    hlen2 = np.sum(h * h, axis=1)
+    hlen = np.sqrt(hlen2)
+    if np.any(hlen == 0.0):
+        raise(ValueError('Inappropriate pos and vel in ' + caller))
+
+    # eccentricity vectors; they can be zero
+    ev = ((rd0len2 - mu / r0len)[:, None] * pos \
+        - np.sum(pos * vel, axis=1)[:, None] * vel) / mu
+    evlen = np.sqrt(np.sum(ev * ev, axis=1))
+    if np.any(evlen == 1.0):
+        raise(ValueError('Inappropriate pos and vel in ' + caller))
+    
+    # directions of the ascending nodes; they can be zero
+    nv = np.zeros((n, 3))
+    nv[:, 0] = (-1.0) * h[:, 1]
+    nv[:, 1] = h[:, 0]
+    nlen = np.sqrt(np.sum(nv * nv, axis=1))
+    
+    ev_norm = np.tile([1.0, 0.0, 0.0], (n, 1))
+    incl = nlen != 0.0
+    circ_incl = (evlen == 0.0) & incl
+    ev_norm[circ_incl] = nv[circ_incl] / nlen[circ_incl, None]
+    ecc = evlen != 0.0
+    ev_norm[ecc] = ev[ecc] / evlen[ecc, None]
+    
+    he = np.cross(h, ev_norm)
+    he_norm = he / np.sqrt(np.sum(he * he, axis=1))[:, None]
+    
+    lan = np.zeros(n)
+    parg = np.arctan2(ev[:, 1], ev[:, 0])
+    n_norm = nv[incl] / nlen[incl, None]
+    hn = np.cross(h[incl], nv[incl])
+    hn_norm = hn / np.sqrt(np.sum(hn * hn, axis=1))[:, None]
+    lan[incl] = np.arctan2(nv[incl, 1], nv[incl, 0])
+    parg[incl] = np.arctan2(np.sum(ev[incl] * hn_norm, axis=1),
+        np.sum(ev[incl] * n_norm, axis=1))
+    
+    elm = {'t0':np.broadcast_to(np.asarray(t, dtype=float), (n,)).copy(),
+        'pos':pos,
+        'vel':vel,
+        'hv':h,
+        'p':hlen2 / mu,
+        'ev':ev,
+        'evd':ev_norm,
+        'e':evlen,
+        'i':np.arccos(h[:, 2] / hlen),
+        'lan':np.mod(lan, math.pi * 2.0),
+        'parg':np.mod(parg, math.pi * 2.0),
+        'ta0':np.mod(np.arctan2(np.sum(he_norm * pos, axis=1),
+            np.sum(ev_norm * pos, axis=1)), math.pi * 2.0)}
+    elm['a'] = elm['p'] / (1.0 - evlen ** 2)
+    return _period_elements(elm, elm['t0'] - _time_from_peri(elm['ta0'],
+        elm['a'], evlen, mu), mu)
+
+
+def _kepl_elements(epoch, a, e, i, LoAN, AoP, TA, T, MA, mu, caller):
+    """Orbital elements for arrays of classical orbital elements
+    
+    Arguments are those of TwoBodyOrbit.setOrbKepl, and each of them may be
+    an array.  Returns a dictionary of Numpy arrays (see _cart_elements).
+    """
+    if TA is None and T is None and MA is None:
+        raise ValueError('Missing Orbital Elements (TA, T, or MA) in ' + caller)
+    anm = TA if TA is not None else (T if T is not None else MA)
+    epoch, a, e, i, LoAN, AoP, anm = [np.array(x, dtype=float) for x in
+        np.broadcast_arrays(epoch, a, e, i, LoAN, AoP, anm)]
+    epoch, a, e, i, LoAN, AoP, anm = [np.atleast_1d(x) for x in
+        (epoch, a, e, i, LoAN, AoP, anm)]
+    
+    if np.any(e < 0.0):
+        raise ValueError('Invalid orbital element (e<0.0) in ' + caller)
+    if np.any(e == 1.0):
+        raise ValueError('Invalid orbital element (e=1.0) in ' + caller)
+    if np.any(((e > 1.0) & (a >= 0.0)) | ((e < 1.0) & (a <= 0.0))):
+        raise ValueError('Invalid Orbital Element(s) (inconsistent e and a) in ' + caller)
+    hyp = e > 1.0
+    if TA is None and T is None and np.any(hyp):
+        raise ValueError('Missing Orbital Element (TA or T) in ' + caller)
+    if TA is not None and np.any(hyp):
+        with np.errstate(invalid='ignore'):
+            mta = np.degrees(np.arccos((-1.0) / e))
+        ta = np.mod(anm, 360.0)
+        if np.any(hyp & (ta >= mta) & (ta <= 360.0 - mta)):
+            raise ValueError('Invalid Orbital Element (TA) in ' + caller)
+
+    n = a.shape[0]
+    elm = {'t0':epoch, 'a':a, 'e':e, 'i':np.radians(i),
+        'lan':np.radians(LoAN), 'parg':np.radians(AoP), 'p':a * (1.0 - e * e)}
+    
+    # R: rotation matrices; columns are directions of periapsis,
+    # of true anomaly 90 degrees, and of angular momentum
+    cl = np.cos(elm['lan'])
+    sl = np.sin(elm['lan'])
+    cp = np.cos(elm['parg'])
+    sp = np.sin(elm['parg'])
+    ci = np.cos(elm['i'])
+    si = np.sin(elm['i'])
+    R = np.empty((n, 3, 3))
+    R[:, 0, 0] = cl * cp - sl * sp * ci
+    R[:, 0, 1] = (-1.0) * cl * sp - sl * cp * ci
+    R[:, 0, 2] = sl * si
+    R[:, 1, 0] = sl * cp + cl * sp * ci
+    R[:, 1, 1] = (-1.0) * sl * sp + cl * cp * ci
+    R[:, 1, 2] = (-1.0) * cl * si
+    R[:, 2, 0] = sp * si
+    R[:, 2, 1] = cp * si
+    R[:, 2, 2] = ci
+    
+    elm['evd'] = R[:, :, 0].copy()
+    elm['ev'] = elm['evd'] * e[:, None]
+    elm['hv'] = R[:, :, 2] * np.sqrt(elm['p'] * mu)[:, None]
+    nv = R[:, :, 1]
+    
+    if TA is not None:
+        elm['ta0'] = np.radians(anm)
+        _period_elements(elm, epoch - _time_from_peri(elm['ta0'], a, e, mu),
+            mu)
+    else:
+        if T is not None:
+            _period_elements(elm, anm, mu)
+        else:
+            with np.errstate(invalid='ignore'):
+                pr = math.pi * 2.0 / math.sqrt(mu) * a ** 1.5
+            _period_elements(elm, epoch - pr * np.radians(anm)
+                / (math.pi * 2.0), mu)
+        # propagate from periapsis to epoch
+        ppos, pvel = _posvel_ta(np.zeros(n), elm['evd'], nv, elm['p'], e, mu)
+        delta_t = epoch - elm['T']
+        xn = _universal_anomaly(delta_t, np.sqrt(np.sum(ppos * ppos,
+            axis=1)), np.sum(ppos * pvel, axis=1), a, mu)
+        pos, vel = _posvel_universal(ppos, pvel, delta_t, xn, a, mu)
+        elm['ta0'] = np.arctan2(np.sum(pos * nv, axis=1),
+            np.sum(pos * elm['evd'], axis=1))
+    
+    elm['pos'], elm['vel'] = _posvel_ta(elm['ta0'], elm['evd'], nv, elm['p'],
+        e, mu)
+    return elm
+
+
+def _period_elements(elm, T, mu):
+    """Adds periapsis passage times, periods, mean motions, and mean
+    anomalies (nan for hyperbolic trajectories) to elm, and returns elm
+    """
+    elm['T'] = np.asarray(T, dtype=float)
+    with np.errstate(invalid='ignore'):
+        elm['pr'] = np.where(elm['e'] < 1.0, math.pi * 2.0 \
+            * np.sqrt(elm['a'] ** 3 / mu), np.nan)
+    elm['mm'] = math.pi * 2.0 / elm['pr']
+    elm['ma'] = np.mod((elm['t0'] - elm['T']) * elm['mm'], math.pi * 2.0)
+    return elm
+
+
+def _dot3(a, b):
+    """Dot product of two 3-vectors (sequences of floats)"""
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _cross3(a, b):
+    """Cross product of two 3-vectors (sequences of floats), as a tuple"""
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2],
+        a[0] * b[1] - a[1] * b[0])
+
+
+def _kepler_elliptic(ma, e, tol=1e-15, maxiter=8, info=None):
+    """Solves Kepler's equation (E - e*sin(E) = M) for elliptic orbits
+    
+    The mean anomaly is reduced to [-pi, pi), and the equation is solved by
+    Danby's quartic iteration from the starter E0 = M + 0.85*e*sign(sin(M)),
+    which converges in two or three iterations for any e (< 1.0).  Cost is
+    bounded by maxiter regardless of M and e.
+    
+    Args:
+        ma: Mean anomaly in radians (float or Numpy array)
+        e: Eccentricity (float or Numpy array)
+        info: Dictionary (optional); 'iterations' and 'fevals' are set
+    Returns: ecc_anm
+        ecc_anm: Eccentric anomaly in radians, which has the same number of
+                 revolutions as ma
+    """
+    if isinstance(ma, float) and isinstance(e, float) and math.isfinite(ma):
+        return _kepler_elliptic_scalar(ma, e, tol, maxiter, info)
+    ma = np.asarray(ma, dtype=float)
+    e = np.asarray(e, dtype=float)
+    nrev = np.floor((ma + math.pi) / (math.pi * 2.0))
+    mr = ma - nrev * (math.pi * 2.0)
+    ecc_anm = mr + 0.85 * e * np.sign(np.sin(mr))
+    for i in range(maxiter):
+        se = e * np.sin(ecc_anm)
+        ce = e * np.cos(ecc_anm)
+        f0 = ecc_anm - se - mr
+        f1 = 1.0 - ce
+        d1 = (-1.0) * f0 / f1
+        d2 = (-1.0) * f0 / (f1 + d1 * se / 2.0)
+        d3 = (-1.0) * f0 / (f1 + d2 * se / 2.0 + d2 * d2 * ce / 6.0)
+        ecc_anm = ecc_anm + d3
+        if np.all(np.abs(d3) < tol):
+            break
+    if info is not None:
+        info['iterations'] = i + 1
+        info['fevals'] = (i + 1) * ma.size
+    return ecc_anm + nrev * (math.pi * 2.0)
+
+
+def _kepler_hyperbolic(ma, e, tol=1e-15, maxiter=30, info=None):
+    """Solves Kepler's equation (e*sinh(H) - H = M) for hyperbolic orbits
+    
+    The equation is solved by Danby's quartic iteration from the starter
+    H0 = sign(M)*log(2*|M|/e + 1.8), which is close to the solution for
+    both small and large M.
+    
+    Args:
+        ma: Hyperbolic mean anomaly (float or Numpy array)
+        e: Eccentricity (float or Numpy array), e > 1.0
+        info: Dictionary (optional); 'iterations' and 'fevals' are set
+    Returns: hyp_anm
+        hyp_anm: Hyperbolic anomaly
+    """
+    if isinstance(ma, float) and isinstance(e, float) and math.isfinite(ma):
+        try:
+            return _kepler_hyperbolic_scalar(ma, e, tol, maxiter, info)
+        except OverflowError:
+            pass
+    ma = np.asarray(ma, dtype=float)
+    e = np.asarray(e, dtype=float)
+    hyp_anm = np.sign(ma) * np.log(2.0 * np.abs(ma) / e + 1.8)
+    for i in range(maxiter):
+        sh = e * np.sinh(hyp_anm)
+        ch = e * np.cosh(hyp_anm)
+        f0 = sh - hyp_anm - ma
+        f1 = ch - 1.0
+        d1 = (-1.0) * f0 / f1
+        d2 = (-1.0) * f0 / (f1 + d1 * sh / 2.0)
+        d3 = (-1.0) * f0 / (f1 + d2 * sh / 2.0 + d2 * d2 * ch / 6.0)
+        hyp_anm = hyp_anm + d3
+        if np.all(np.abs(d3) < tol * np.maximum(1.0, np.abs(hyp_anm))):
+            break
+    if info is not None:
+        info['iterations'] = i + 1
+        info['fevals'] = (i + 1) * ma.size
+    return hyp_anm
+
+
+def _kepler_elliptic_scalar(ma, e, tol, maxiter, info):
+    """_kepler_elliptic for float ma and e, with the math module"""
+    nrev = math.floor((ma + math.pi) / (math.pi * 2.0))
+    mr = ma - nrev * (math.pi * 2.0)
+    sm = math.sin(mr)
+    ecc_anm = mr + 0.85 * e * (1.0 if sm > 0.0 else (-1.0 if sm < 0.0 else
+        0.0))
+    for i in range(maxiter):
+        se = e * math.sin(ecc_anm)
+        ce = e * math.cos(ecc_anm)
+        f0 = ecc_anm - se - mr
+        f1 = 1.0 - ce
+        d1 = (-1.0) * f0 / f1
+        d2 = (-1.0) * f0 / (f1 + d1 * se / 2.0)
+        d3 = (-1.0) * f0 / (f1 + d2 * se / 2.0 + d2 * d2 * ce / 6.0)
+        ecc_anm = ecc_anm + d3
+        if abs(d3) < tol:
+            break
+    if info is not None:
+        info['iterations'] = i + 1
+        info['fevals'] = i + 1
+    return ecc_anm + nrev * (math.pi * 2.0)
+
+
+def _kepler_hyperbolic_scalar(ma, e, tol, maxiter, info):
+    """_kepler_hyperbolic for float ma and e, with the math module"""
+    hyp_anm = math.copysign(math.log(2.0 * abs(ma) / e + 1.8), ma) \
+        if ma != 0.0 else 0.0
+    for i in range(maxiter):
+        sh = e * math.sinh(hyp_anm)
+        ch = e * math.cosh(hyp_anm)
+        f0 = sh - hyp_anm - ma
+        f1 = ch - 1.0
+        d1 = (-1.0) * f0 / f1
+        d2 = (-1.0) * f0 / (f1 + d1 * sh / 2.0)
+        d3 = (-1.0) * f0 / (f1 + d2 * sh / 2.0 + d2 * d2 * ch / 6.0)
+        hyp_anm = hyp_anm + d3
+        if abs(d3) < tol * max(1.0, abs(hyp_anm)):
+            break
+    if info is not None:
+        info['iterations'] = i + 1
+        info['fevals'] = i + 1
+    return hyp_anm
+
+
+def _true_anomaly(ma, e):
+    """True anomaly for mean anomaly ma (float or Numpy array) of an orbit
+    
+    For an elliptic orbit, values are in [0, 2*pi); for a hyperbolic
+    trajectory, values are between the asymptotes.
+    """
+    if isinstance(ma, float) and math.isfinite(ma):
+        if e < 1.0:
+            anm = _kepler_elliptic(ma, e)
+            ta = 2.0 * math.atan2(math.sqrt(1.0 + e) * math.sin(anm / 2.0),
+                math.sqrt(1.0 - e) * math.cos(anm / 2.0))
+            return ta % (math.pi * 2.0)
+        anm = _kepler_hyperbolic(ma, e)
+        return 2.0 * math.atan(math.sqrt((e + 1.0) / (e - 1.0)) \
+            * math.tanh(anm / 2.0))
+    if e < 1.0:
+        anm = _kepler_elliptic(ma, e)
+        ta = 2.0 * np.arctan2(math.sqrt(1.0 + e) * np.sin(anm / 2.0),
+            math.sqrt(1.0 - e) * np.cos(anm / 2.0))
+        return np.mod(ta, math.pi * 2.0)
+    anm = _kepler_hyperbolic(ma, e)
+    return 2.0 * np.arctan(math.sqrt((e + 1.0) / (e - 1.0)) \
+        * np.tanh(anm / 2.0))
+
+
+class _ChebyshevCache:
+    """Piecewise Chebyshev polynomials of an ephemeris
+    
+    Time is divided into segments of length span / 2**level, aligned to an
+    origin.  A segment is fitted at level 0 first, and is split into halves
+    until the fit satisfies the accuracy target.  Fitted segments are kept
+    in an OrderedDict keyed by (level, index) for LRU eviction; a split
+    segment is kept as a key with value None.
+    """
+    maxlevel = 24
+    
+    def __init__(self, rtol, maxsegments, degree):
+        self.rtol = rtol
+        self.maxsegments = maxsegments
+        self.degree = degree
+        # Chebyshev nodes, and check points between them, in [-1, 1]
+        self._nodes = np.cos(math.pi * (np.arange(degree + 1) + 0.5) \
+            / (degree + 1))
+        self._checks = np.cos(math.pi * np.arange(1, degree + 1) \
+            / (degree + 1))
+        self._orders = np.arange(degree + 1)
+        self.clear()
+    
+    def clear(self):
+        self.origin = None
+        self.span = None
+        self.segments = OrderedDict()
+        self.nfitted = 0
+    
+    def fit(self, exact, origin, span, t1, t2):
+        if self.origin is None:
+            self.origin = origin
+            self.span = span
+        k1 = math.floor((min(t1, t2) - self.origin) / self.span)
+        k2 = math.floor((max(t1, t2) - self.origin) / self.span)
+        for k in range(k1, k2 + 1):
+            self._fitSegment(exact, 0, k)
+    
+    def _fitSegment(self, exact, level, k):
+        key = (level, k)
+        if key in self.segments:
+            if self.segments[key] is None:
+                self._fitSegment(exact, level + 1, k * 2)
+                self._fitSegment(exact, level + 1, k * 2 + 1)
+            else:
+                self.segments.move_to_end(key)
+            return
+        h = self.span / 2.0 ** level
+        tstart = self.origin + k * h
+        pos, vel = exact(tstart + (self._nodes + 1.0) * h / 2.0)
+        coef = np.linalg.lstsq(self._basis(self._nodes), np.hstack((pos, vel)),
+            rcond=None)[0]
+        
+        # check errors between the nodes
+        pos, vel = exact(tstart + (self._checks + 1.0) * h / 2.0)
+        val = np.dot(self._basis(self._checks), coef)
+        perr = np.sqrt(np.sum((val[:, :3] - pos) ** 2, axis=1))
+        verr = np.sqrt(np.sum((val[:, 3:] - vel) ** 2, axis=1))
+        good = np.all(perr <= self.rtol * np.sqrt(np.sum(pos * pos, axis=1))) \
+            and np.all(verr <= self.rtol * np.sqrt(np.sum(vel * vel, axis=1)))
+        if good or level >= self.maxlevel:
+            self.segments[key] = coef
+            self.nfitted += 1
+            while self.nfitted > self.maxsegments:
+                self._evict()
+        else:
+            self.segments[key] = None
+            self._fitSegment(exact, level + 1, k * 2)
+            self._fitSegment(exact, level + 1, k * 2 + 1)
+    
+    def _evict(self):
+        for key, coef in self.segments.items():
+            if coef is not None:
+                del self.segments[key]
+                self.nfitted -= 1
+                return
+    
+    def _find(self, t):
+        """Returns (key, x) of the fitted segment containing t, or None"""
+        if self.origin is None:
+            return None
+        for level in range(self.maxlevel + 1):
+            h = self.span / 2.0 ** level
+            u = (t - self.origin) / h
+            k = math.floor(u)
+            key = (level, k)
+            if key not in self.segments:
+                return None
+            if self.segments[key] is not None:
+                return key, (u - k) * 2.0 - 1.0
+        return None
+    
+    def posvel(self, t):
+        found = self._find(t)
+        if found is None:
+            return None
+        key, x = found
+        self.segments.move_to_end(key)
+        # T_k(x) = cos(k * arccos(x))
+        val = np.dot(np.cos(self._orders * math.acos(min(max(x, -1.0), 1.0))),
+            self.segments[key])
+        return val[:3], val[3:]
+    
+    def _basis(self, x):
+        """Chebyshev polynomials T_0..T_degree at x, as (len(x),degree+1)"""
+        tk = np.empty((self.degree + 1, x.shape[0]))
+        tk[0] = 1.0
+        tk[1] = x
+        x2 = 2.0 * x
+        for k in range(2, self.degree + 1):
+            np.multiply(x2, tk[k - 1], out=tk[k])
+            tk[k] -= tk[k - 2]
+        return tk.T
+    
+    def posvelArray(self, t):
+        n = t.shape[0]
+        newpos = np.empty((n, 3))
+        newvel = np.empty((n, 3))
+        hit = np.zeros(n, dtype=bool)
+        if self.origin is None:
+            return newpos, newvel, hit
+        todo = np.arange(n)
+        for level in range(self.maxlevel + 1):
+            if todo.size == 0:
+                break
+            h = self.span / 2.0 ** level
+            u = (t[todo] - self.origin) / h
+            k = np.floor(u)
+            # group queries by segment
+            order = np.argsort(k, kind='stable')
+            kk, first = np.unique(k[order], return_index=True)
+            bounds = np.append(first, order.size)
+            deeper = []
+            for j in range(kk.size):
+                key = (level, int(kk[j]))
+                if key not in self.segments:
+                    continue
+                sel = order[bounds[j]:bounds[j + 1]]
+                coef = self.segments[key]
+                if coef is None:
+                    deeper.append(todo[sel])
+                    continue
+                self.segments.move_to_end(key)
+                idx = todo[sel]
+                val = np.dot(self._basis((u[sel] - kk[j]) * 2.0 - 1.0), coef)
+                newpos[idx] = val[:, :3]
+                newvel[idx] = val[:, 3:]
+                hit[idx] = True
+            todo = np.concatenate(deeper) if deeper else np.arange(0)
+        return newpos, newvel, hit
 
   
 class TwoBodyOrbit:
@@ -27,56 +1172,98 @@ class TwoBodyOrbit:
         """Computes time from periapsis passage for given true anomaly
         
         Args:
-            ta: True Anomaly in radians
+            ta: True Anomaly in radians, or array-like object of true
+                anomalies
         Returns: sec_from_peri
-            sec_from_peri: Time from periapsis passage (float). Unit of time
-                           depends on gravitational parameter (mu)
+            sec_from_peri: Time from periapsis passage (float), or Numpy array
+                           of times for array of ta. Unit of time depends on
+                           gravitational parameter (mu)
         """
         if not self._setOrb:
             raise(RuntimeError('Orbit has not been defined: in TwoBodyOrbit.timeFperi'))
+        
+        if np.ndim(ta) > 0:
+            return _time_from_peri(ta, self.a, self.e, self.mu)
             
-        r = self.a * (1.0 - self.e ** 2) / (1.0 + self.e * np.cos(ta))
-        if self.e < 1.0:
-            b_over_a = np.sqrt(1.0 - self.e ** 2)
-            ecc_anm = np.arctan2(r * np.sin(ta) / b_over_a, self.a * self.e \
-                + r * np.cos(ta))
-            if ecc_anm < 0.0: ecc_anm += math.pi * 2.0
-            sec_from_peri = np.sqrt(self.a **3 / self.mu) * (ecc_anm - self.e \
-                * np.sin(ecc_anm))
-        elif self.e == 1.0:
-            ecc_anm = np.sqrt(self.p) * np.tan(ta / 2.0)
-            sec_from_peri = (self.p * ecc_anm + ecc_anm ** 3 / 3.0) / 2.0 / \
-                np.sqrt(self.mu)
-        else:
-            sy = (self.e + np.cos(ta)) / (1.0 + self.e * np.cos(ta))
-            lf = np.log(sy + np.sqrt(sy ** 2 - 1.0))
-            if (ta < 0.0) or (ta > math.pi): lf = lf * (-1.0)
-            sec_from_peri = np.sqrt((-1.0) * self.a ** 3 / self.mu) * (self.e \
-                * np.sinh(lf) - lf)
-        return sec_from_peri
+        return _time_from_peri_scalar(ta, self.a, self.e, self.p, self.mu)
         
     def posvel(self, ta):
         """Comuputs position and velocity for given true anomaly
         
         Args:
-            ta: True Anomaly in radians
+            ta: True Anomaly in radians, or array-like object of N true
+                anomalies
         Returns: rv, vv
-            rv: Position (x,y,z) as numpy array
-            vv: Velocity (xd,yd,zd) as numpy array
+            rv: Position (x,y,z) as numpy array, (N,3) array for array of ta
+            vv: Velocity (xd,yd,zd) as numpy array, (N,3) array for array of ta
                 Units are depend on gravitational parameter (mu)
         """
         if not self._setOrb:
             raise(RuntimeError('Orbit has not been defined: in TwoBodyOrbit.posvel'))
+        
+        if np.ndim(ta) > 0:
+            return _posvel_ta(ta, self._PV, self._QV, self.p, self.e, self.mu)
+
+        return _posvel_ta_scalar(ta, self._PVt, self._QVt, self.p, self.e,
+            self.mu)
+
+    def taAtTime(self, t):
+        """Computes true anomaly at given time
+        
+        Inverse of timeFperi; Kepler's equation is solved in eccentric or
+        hyperbolic anomaly.
+        
+        Args:
+            t: Time, or array-like object of times
+        Returns: ta
+            ta: True anomaly in radians (float), or Numpy array of true
+                anomalies for array of t. For an elliptic orbit, values are
+                in [0, 2*pi); for a hyperbolic trajectory, values are
+                between the asymptotes
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: in TwoBodyOrbit.taAtTime'))
+        
+        ta = _true_anomaly(self._ma0 + self._nmean * (np.asarray(t,
+            dtype=float) - self.t0), self.e)
+        if np.ndim(ta) == 0:
+            return float(ta)
+        return ta
 
-        PV = self.evd
-        QV = np.cross(self.hv, PV) / np.sqrt(np.dot(self.hv, self.hv))
-        r = self.p / (1.0 + self.e * np.cos(ta))
-        rv = r * np.cos(ta) * PV + r * np.sin(ta) * QV
-        vv = np.sqrt(self.mu / self.p) * ((-1.0) * np.sin(ta) * PV + (self.e \
-            + np.cos(ta)) * QV)
-        return rv, vv
+    def eventTimes(self, kind, t1, t2, radius=None):
+        """Computes times of an event between t1 and t2
+        
+        Times are computed analytically from the true anomaly of the event
+        (by timeFperi), not by sampling.
+        Args:
+            kind: Kind of the event
+                'periapsis': Periapsis passage
+                'apoapsis': Apoapsis passage (elliptic orbit only)
+                'ascending', 'descending': Ascending or descending node
+                    (none for an equatorial orbit)
+                'radius_out', 'radius_in': Crossing of given radius with
+                    increasing or decreasing distance
+                'radius': Both of 'radius_out' and 'radius_in'
+            t1: Start time of the interval
+            t2: End time of the interval
+            radius: Distance from the central body (for radius events)
+        Returns: times
+            times: Sorted Numpy array of times of the event
+        Exception:
+            ValueError: If kind is invalid, or radius is not given for
+                        radius events, raises ValueError
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: in TwoBodyOrbit.eventTimes'))
+        
+        pr = np.nan if self.pr is None else self.pr
+        times = [_event_times(ta, self.T, pr, self.a, self.e, self.mu, t1,
+            t2)[1] for ta in _event_anomalies(kind, np.array([self.e]),
+            self.p, self.parg, self.i, radius)]
+        return np.sort(np.concatenate(times))
 
-    def __init__(self, bname, mname='Sun', mu=1.32712440041e20):
+    def __init__(self, bname, mname='Sun', mu=1.32712440041e20,
+                 solver='anomaly'):
         """
         Args:
             bname: Name of the object which orbit around the central body
@@ -94,11 +1281,191 @@ class TwoBodyOrbit:
                     G: Newton's gravitational constant
                     Mc: mass of the central body
                     Mo: mass of the object
+            solver: Solver of Kepler's equation used by posvelatt
+                'anomaly': By orbit type,
+                    elliptic orbit (e < 0.99): Kepler's equation in
+                        eccentric anomaly
+                    hyperbolic trajectory (e > 1.01): Kepler's equation in
+                        hyperbolic anomaly
+                    near-parabolic orbit (|1 - e| < 0.01): the solution in
+                        eccentric or hyperbolic anomaly is refined in
+                        universal variable by Newton iteration
+                    Cost of the computation is bounded regardless of time,
+                    except for the refinement of near-parabolic orbits
+                'universal': Kepler's equation in universal variable solved
+                    by scipy.optimize.newton (and bisect as a fallback), for
+                    all orbit types
         """
+        if solver not in ('anomaly', 'universal'):
+            raise(ValueError('Invalid solver in TwoBodyOrbit'))
         self._setOrb = False
         self.bodyname = bname
         self.mothername = mname
         self.mu = mu
+        self.solver = solver
+        self._cache = None
+    
+    def _setBasis(self):
+        """Caches unit vectors of the perifocal frame (P, Q)
+        
+        Should be called whenever hv or evd is redefined.
+        """
+        # tuples of floats for scalar computations
+        self._PVt, self._QVt = _basis(self.evd, self.hv)
+        self._PV = self.evd
+        self._QV = np.array(self._QVt)
+    
+    def _setElements(self, elm):
+        """Sets orbital elements (dictionary keyed by attribute names), and
+        caches the basis and invariants
+        
+        The orbit is marked as defined last, so that it is never marked as
+        defined with elements of different orbits.
+        """
+        self._setOrb = False
+        for key, value in elm.items():
+            setattr(self, key, value)
+        self._setBasis()
+        self._setEpochInvariants()
+        self._setOrb = True
+    
+    def _setEpochInvariants(self):
+        """Caches invariants of the orbit used by posvelatt
+        
+        Should be called whenever t0, pos, vel, or a is redefined.
+        """
+        pos = tuple(float(c) for c in self.pos)
+        vel = tuple(float(c) for c in self.vel)
+        self._sqmu = math.sqrt(self.mu)                         # sqrt(mu)
+        self._sr0 = math.sqrt(_dot3(pos, pos))                 # r0
+        self._sigma0 = _dot3(pos, vel) / self._sqmu
+        self._alpha = 1.0 / self.a                              # 1/a
+        # factors of Kepler's equation in eccentric or hyperbolic anomaly
+        self._sqe = math.sqrt(abs(1.0 - self.e ** 2))           # b/|a|
+        self._nmean = math.sqrt(self.mu / abs(self.a) ** 3)      # mean motion
+        self._sqmua = math.sqrt(self.mu * abs(self.a))
+        # eccentric (or hyperbolic) and mean anomalies at epoch in (-pi, pi],
+        # from true anomaly at epoch (not from T, which may be far from the
+        # epoch and lose precision)
+        ta = math.remainder(self.ta0, math.pi * 2.0)
+        if self.e < 1.0:
+            self._anm0 = 2.0 * math.atan2(math.sqrt(1.0 - self.e)
+                * math.sin(ta / 2.0), math.sqrt(1.0 + self.e)
+                * math.cos(ta / 2.0))
+            self._ma0 = self._anm0 - self.e * math.sin(self._anm0)
+        else:
+            self._anm0 = 2.0 * math.atanh(math.sqrt((self.e - 1.0) / (self.e
+                + 1.0)) * math.tan(ta / 2.0))
+            self._ma0 = self.e * math.sinh(self._anm0) - self._anm0
+        # cached ephemeris of the previous orbit is no longer valid
+        if self._cache is not None:
+            self._cache.clear()
+    
+    def _posvelAnomaly(self, t, info=None):
+        """Position and velocity at t by Kepler's equation in eccentric or
+        hyperbolic anomaly; t may be a float or a Numpy array
+        """
+        if abs(1.0 - self.e) < _NEAR_PARABOLIC:
+            return self._posvelNearParabolic(t, info)
+        ma = self._ma0 + self._nmean * (t - self.t0)
+        if isinstance(ma, float) and math.isfinite(ma):
+            return self._posvelAnomalyScalar(ma, info)
+        if self.e < 1.0:
+            anm = _kepler_elliptic(ma, self.e, info=info)
+            ca = np.cos(anm)
+            sa = np.sin(anm)
+            r = self.a * (1.0 - self.e * ca)
+            xp = self.a * (ca - self.e)
+            yp = self.a * self._sqe * sa
+            vxp = (-1.0) * self._sqmua * sa / r
+            vyp = self._sqmua * self._sqe * ca / r
+        else:
+            anm = _kepler_hyperbolic(ma, self.e, info=info)
+            ca = np.cosh(anm)
+            sa = np.sinh(anm)
+            r = self.a * (1.0 - self.e * ca)
+            xp = self.a * (ca - self.e)
+            yp = (-1.0) * self.a * self._sqe * sa
+            vxp = (-1.0) * self._sqmua * sa / r
+            vyp = self._sqmua * self._sqe * ca / r
+        xp = np.asarray(xp)[..., None]
+        yp = np.asarray(yp)[..., None]
+        vxp = np.asarray(vxp)[..., None]
+        vyp = np.asarray(vyp)[..., None]
+        return xp * self._PV + yp * self._QV, vxp * self._PV + vyp * self._QV
+    
+    def _posvelNearParabolic(self, t, info):
+        """_posvelAnomaly for a near-parabolic orbit (|1 - e| <
+        _NEAR_PARABOLIC)
+        
+        Near e = 1, Kepler's equation in eccentric or hyperbolic anomaly is
+        ill-conditioned for times near the epoch.  Its solution is used as
+        the initial guess of universal anomaly, which is refined by Newton
+        iteration from the state at epoch.
+        """
+        delta_t = t - self.t0
+        if self.e < 1.0:
+            # whole periods are removed, so that universal anomaly stays
+            # within one revolution
+            delta_t = delta_t - self.pr * np.round(delta_t / self.pr)
+            anm = _kepler_elliptic(self._ma0 + self._nmean * delta_t, self.e)
+            x0 = math.sqrt(self.a) * (anm - self._anm0)
+        else:
+            anm = _kepler_hyperbolic(self._ma0 + self._nmean * delta_t,
+                self.e)
+            x0 = math.sqrt((-1.0) * self.a) * (anm - self._anm0)
+        
+        if isinstance(x0, float) and math.isfinite(x0):
+            # a float is refined with the math module
+            sr = self._sr0
+            sigma = self._sigma0
+            alpha = self._alpha
+            xn = x0
+            for i in range(8):
+                z = xn * xn * alpha
+                cz, sz = _stumpff(z)
+                fval = (sigma * xn * xn * cz + (1.0 - sr * alpha) * xn ** 3 \
+                    * sz + sr * xn) / self._sqmu - delta_t
+                fder = (xn * xn * cz + sigma * xn * (1.0 - z * sz) + sr \
+                    * (1.0 - z * cz)) / self._sqmu
+                dx = fval / fder
+                xn -= dx
+                if abs(dx) < 1.48e-8:
+                    if info is not None:
+                        info['iterations'] = i + 1
+                        info['fevals'] = i + 1
+                    return self._posvelUniversal(delta_t, xn)
+        
+        xn = _universal_anomaly(delta_t, self._sr0, self._sigma0 * self._sqmu,
+            self.a, self.mu, info=info, x0=x0)
+        return _posvel_universal(self.pos, self.vel, delta_t, xn, self.a,
+            self.mu)
+    
+    def _posvelAnomalyScalar(self, ma, info):
+        """_posvelAnomaly for a float mean anomaly, with the math module"""
+        a = self.a
+        e = self.e
+        if e < 1.0:
+            anm = _kepler_elliptic(ma, e, info=info)
+            ca = math.cos(anm)
+            sa = math.sin(anm)
+            r = a * (1.0 - e * ca)
+            xp = a * (ca - e)
+            yp = a * self._sqe * sa
+        else:
+            anm = _kepler_hyperbolic(ma, e, info=info)
+            ca = math.cosh(anm)
+            sa = math.sinh(anm)
+            r = a * (1.0 - e * ca)
+            xp = a * (ca - e)
+            yp = (-1.0) * a * self._sqe * sa
+        vxp = (-1.0) * self._sqmua * sa / r
+        vyp = self._sqmua * self._sqe * ca / r
+        px, py, pz = self._PVt
+        qx, qy, qz = self._QVt
+        return (np.array([xp * px + yp * qx, xp * py + yp * qy,
+            xp * pz + yp * qz]), np.array([vxp * px + vyp * qx,
+            vxp * py + vyp * qy, vxp * pz + vyp * qz]))
     
     def setOrbCart(self, t, pos, vel):
         """Define the orbit by epoch, position, and velocity of the object
@@ -115,84 +1482,91 @@ class TwoBodyOrbit:
                 ValueError
                         when e becomes 1.0, the method raises ValueError
         """
-        self.t0 = t
-        self.pos = np.array(pos)
-        self.vel = np.array(vel)
-        self._setOrb = True
+        # Computes Classical orbital elements; 3-vectors are tuples of
+        # floats, which are faster than Numpy arrays for single vectors
+        r0 = tuple(float(c) for c in pos)
+        r0len = math.sqrt(_dot3(r0, r0))
         
-        # Computes Classical orbital elements
-        r0 = np.array(self.pos)
-        r0len = np.sqrt(np.dot(r0, r0))
+        rd0 = tuple(float(c) for c in vel)
+        rd0len2 = _dot3(rd0, rd0)
         
-        rd0 = np.array(self.vel)
-        rd0len2 = np.dot(rd0, rd0)
-        
-        h = np.cross(r0, rd0)
-        hlen2 = np.dot(h, h)
-        hlen = np.sqrt(hlen2)
+        h = _cross3(r0, rd0)
+        hlen2 = _dot3(h, h)
+        hlen = math.sqrt(hlen2)
         if hlen == 0.0:
             self._setOrb = False
             raise(ValueError('Inappropriate pos and vel in TwoBodyOrbit.setOrbCart'))
 
         # eccentricity vector; it can be zero
-        ev = ((rd0len2 - self.mu/r0len) * r0 - np.dot(r0, rd0) * rd0) / self.mu
-        evlen = np.sqrt(np.dot(ev, ev))     #evlen can be zero (circular orbit)
+        cr = rd0len2 - self.mu / r0len
+        rdotv = _dot3(r0, rd0)
+        ev = tuple((cr * r0[k] - rdotv * rd0[k]) / self.mu for k in range(3))
+        evlen = math.sqrt(_dot3(ev, ev))    #evlen can be zero (circular orbit)
+        if evlen == 1.0:
+            self._setOrb = False
+            raise(ValueError('Inappropriate pos and vel in TwoBodyOrbit.setOrbCart'))
         
-        K = np.array([0., 0., 1.])
-        n = np.cross(K, h)                  # direction of the ascending node
-        nlen = np.sqrt(np.dot(n, n))        # nlen can be zero (orbital inclination is zero)
+        n = ((-1.0) * h[1], h[0], 0.0)      # direction of the ascending node
+        nlen = math.sqrt(_dot3(n, n))       # nlen can be zero (orbital inclination is zero)
         
         if evlen == 0.0:
             if nlen == 0.0:
-                ev_norm = np.array([1.0, 0.0, 0.0])
+                ev_norm = (1.0, 0.0, 0.0)
             else:
-                ev_norm = n / nlen
+                ev_norm = tuple(c / nlen for c in n)
         else:
-            ev_norm = ev / evlen
+            ev_norm = tuple(c / evlen for c in ev)
  
-        he = np.cross(h, ev)
-        he_norm = he / np.sqrt(np.dot(he, he))
+        he = _cross3(h, ev_norm)
+        helen = math.sqrt(_dot3(he, he))
+        he_norm = tuple(c / helen for c in he)
         
         if nlen == 0.0:
-            self.lan = 0.0
-            self.parg = np.arctan2(ev[1], ev[0])
-            if self.parg < 0.0:
-                self.parg += math.pi * 2.0
+            lan = 0.0
+            parg = math.atan2(ev[1], ev[0])
+            if parg < 0.0:
+                parg += math.pi * 2.0
         else:
-            n_norm = n / nlen
-            hn = np.cross(h, n)
-            hn_norm = hn / np.sqrt(np.dot(hn, hn))
-            self.lan = np.arctan2(n[1], n[0])   # longitude of ascending node (radians)
-            if self.lan < 0.0:
-                self.lan += math.pi * 2.0
-            self.parg = np.arctan2(np.dot(ev, hn_norm), np.dot(ev, n_norm))    # periapsis argument (radians)
-            if self.parg < 0.0:
-                self.parg += math.pi * 2.0
-        
-        self.hv = h                             # orbital mormentum vecctor
-        self.p = hlen2 / self.mu                # semi-latus rectum
-        self.ev = ev                            # eccentricity vector
-        self.evd = ev_norm                      # normalized eccentricity vector
-        self.e = np.sqrt(np.dot(ev, ev))        # eccentricity
-        if self.e == 1.0:
-            self._setOrb = False
-            raise(ValueError('Inappropriate pos and vel in TwoBodyOrbit.setOrbCart'))
-        self.a = self.p / (1.0 - self.e ** 2)   # semi-major axis
-        self.i = np.arccos(h[2] / hlen)         # inclination (radians)
-        self.ta0 = np.arctan2(np.dot(he_norm, r0), np.dot(ev_norm, r0))     # true anomaly at epoch
-        if self.ta0 < 0.0:
-            self.ta0 += math.pi * 2.0
+            n_norm = tuple(c / nlen for c in n)
+            hn = _cross3(h, n)
+            hnlen = math.sqrt(_dot3(hn, hn))
+            hn_norm = tuple(c / hnlen for c in hn)
+            lan = math.atan2(n[1], n[0])    # longitude of ascending node (radians)
+            if lan < 0.0:
+                lan += math.pi * 2.0
+            parg = math.atan2(_dot3(ev, hn_norm), _dot3(ev, n_norm))  # periapsis argument (radians)
+            if parg < 0.0:
+                parg += math.pi * 2.0
+        
+        p = hlen2 / self.mu                 # semi-latus rectum
+        e = evlen                           # eccentricity
+        a = p / (1.0 - e ** 2)              # semi-major axis
+        ta0 = math.atan2(_dot3(he_norm, r0), _dot3(ev_norm, r0))  # true anomaly at epoch
+        if ta0 < 0.0:
+            ta0 += math.pi * 2.0
 
         # time from recent periapsis, mean anomaly, periapsis passage time        
-        timef = self.timeFperi(self.ta0)
-        self.ma = None
-        self.pr = None
-        self.mm = None
-        if self.e < 1.0:
-            self.pr = (2.0 * math.pi * np.sqrt(self.a ** 3 /self.mu))   # orbital period
-            self.ma = timef / self.pr * math.pi * 2.0                   # Mean anomaly (rad)
-            self.mm = 2.0 * math.pi / self.pr                           # mean motion (rad/time)
-        self.T = self.t0 - timef                                        # periapsis passage time
+        timef = _time_from_peri_scalar(ta0, a, e, p, self.mu)
+        ma = None
+        pr = None
+        mm = None
+        if e < 1.0:
+            pr = (2.0 * math.pi * math.sqrt(a ** 3 /self.mu))  # orbital period
+            ma = timef / pr * math.pi * 2.0                     # Mean anomaly (rad)
+            mm = 2.0 * math.pi / pr                             # mean motion (rad/time)
+        
+        # the orbit is marked as defined after all elements are set
+        self._setElements({
+            't0': t, 'pos': np.array(pos), 'vel': np.array(vel),
+            'lan': lan, 'parg': parg,
+            'hv': np.array(h),              # orbital mormentum vecctor
+            'p': p,
+            'ev': np.array(ev),             # eccentricity vector
+            'evd': np.array(ev_norm),       # normalized eccentricity vector
+            'e': e, 'a': a,
+            'i': math.acos(max(-1.0, min(1.0, h[2] / hlen))),  # inclination (radians)
+            'ta0': ta0, 'ma': ma, 'pr': pr, 'mm': mm,
+            'T': t - timef})                # periapsis passage time
 
     def setOrbKepl(self, epoch, a, e, i, LoAN, AoP, TA=None, T=None, MA=None):
         """Define the orbit by classical orbital elements
@@ -259,116 +1633,98 @@ class TwoBodyOrbit:
             if taError:
                 raise ValueError('Invalid Orbital Element (TA) in TwoBodyOrbit.setOrbKepl')
             
-        self.t0 = epoch
-        self.a = a
-        self.e = e
-        self.i = math.radians(i)
-        self.lan = math.radians(Lomega)
-        self.parg = math.radians(Somega)
+        inc = math.radians(i)
+        lan = math.radians(Lomega)
+        parg = math.radians(Somega)
 
-        self.pr = None
-        self.ma = None
-        self.mm = None
-
-        self._setOrb = True
+        pr = None
+        mm = None
 
         # semi-latus rectum        
-        self.p = a * (1.0 - e * e)
+        p = a * (1.0 - e * e)
             
         # orbital period and mean motion
         if e < 1.0:
-            self.pr = math.pi * 2.0 / math.sqrt(self.mu) * a ** 1.5
-            self.mm = math.pi * 2.0 / self.pr
+            pr = math.pi * 2.0 / math.sqrt(self.mu) * a ** 1.5
+            mm = math.pi * 2.0 / pr
 
         # R: rotation matrix
-        R1n = np.array([math.cos(self.lan)*math.cos(self.parg) 
-                    - math.sin(self.lan)*math.sin(self.parg)*math.cos(self.i),
-                    (-1.0)*math.cos(self.lan)*math.sin(self.parg) 
-                    - math.sin(self.lan)*math.cos(self.parg)*math.cos(self.i),
-                       math.sin(self.lan)*math.sin(self.i)])
-        R2n = np.array([math.sin(self.lan)*math.cos(self.parg) 
-                    + math.cos(self.lan)*math.sin(self.parg)*math.cos(self.i),
-                    (-1.0)*math.sin(self.lan)*math.sin(self.parg) 
-                    + math.cos(self.lan)*math.cos(self.parg)*math.cos(self.i),
-                    (-1.0)*math.cos(self.lan)*math.sin(self.i)])
-        R3n = np.array([math.sin(self.parg)*math.sin(self.i),
-                    math.cos(self.parg)*math.sin(self.i),
-                    math.cos(self.i)])
+        R1n = np.array([math.cos(lan)*math.cos(parg) 
+                    - math.sin(lan)*math.sin(parg)*math.cos(inc),
+                    (-1.0)*math.cos(lan)*math.sin(parg) 
+                    - math.sin(lan)*math.cos(parg)*math.cos(inc),
+                       math.sin(lan)*math.sin(inc)])
+        R2n = np.array([math.sin(lan)*math.cos(parg) 
+                    + math.cos(lan)*math.sin(parg)*math.cos(inc),
+                    (-1.0)*math.sin(lan)*math.sin(parg) 
+                    + math.cos(lan)*math.cos(parg)*math.cos(inc),
+                    (-1.0)*math.cos(lan)*math.sin(inc)])
+        R3n = np.array([math.sin(parg)*math.sin(inc),
+                    math.cos(parg)*math.sin(inc),
+                    math.cos(inc)])
         R = np.array([R1n, R2n, R3n])
 
         # eccentricity vector
-        self.evd = (np.dot(R, np.array([[1.0], [0.0], [0.0]]))).T[0]
-        self.ev = self.evd * self.e
+        evd = (np.dot(R, np.array([[1.0], [0.0], [0.0]]))).T[0]
         # angular momentum vector
-        h = math.sqrt(self.p * self.mu)
-        self.hv = (np.dot(R, np.array([[0.0], [0.0], [1.0]]))).T[0] * h
-        nv = (np.dot(R, np.array([[0.0], [1.0], [0.0]]))).T[0]
+        h = math.sqrt(p * self.mu)
+        hv = (np.dot(R, np.array([[0.0], [0.0], [1.0]]))).T[0] * h
         
         # ta0, T, ma
         if TAoE is not None:
             # true anomaly at epoch
-            self.ta0 = math.radians(TAoE)
+            ta0 = math.radians(TAoE)
             # periapsis passage time
-            self.T = self.t0 - self.timeFperi(self.ta0)
+            T = epoch - _time_from_peri_scalar(ta0, a, e, p, self.mu)
             # mean anomaly at epoch
-            if self.e < 1.0:
-                self.ma = (self.t0 - self.T) / self.pr * math.pi * 2.0
+            if e < 1.0:
+                ma = (epoch - T) / pr * math.pi * 2.0
             else:
-                self.ma = None
+                ma = None
         elif T is not None:
-            # periapsis passage time
-            self.T = T
-            # position and velocity on periapsis
-            self.pos, self.vel = self.posvel(0.0)
-            # position and velocity at epoch
-            self.t0 = self.T   # temporary setting
-            pos, vel = self.posvelatt(epoch)
             # true anomaly at epoch
-            ev_norm = self.evd
-            nv_norm = nv / np.sqrt(np.dot(nv, nv))
-            pos_norm = pos / np.sqrt(np.dot(pos, pos))
-            # true anomaly at epoch
-            self.ta0 = np.arctan2(np.dot(pos_norm, nv_norm), np.dot(pos_norm, ev_norm))
+            ta0 = _ta_at_epoch(epoch, T, a, e, self.mu)
             # mean anomaly at epoch
-            if self.e < 1.0:
-                self.ma = (epoch - self.T) / self.pr * math.pi * 2.0
-                if self.ma < 0.0:
-                    self.ma += math.pi * 2.0
+            if e < 1.0:
+                ma = (epoch - T) / pr * math.pi * 2.0
+                if ma < 0.0:
+                    ma += math.pi * 2.0
             else:
-                self.ma = None
+                ma = None
         else:
             # mean anomaly at epoch
-            self.ma = math.radians(ma)
+            ma = math.radians(ma)
             # periapsis passage time
-            self.T = epoch - self.pr * self.ma / (math.pi * 2.0)
-            # position and velocity on periapsis
-            self.pos, self.vel = self.posvel(0.0)
-            # position and velocity at epoch
-            self.t0 = self.T   # temporary setting
-            pos, vel = self.posvelatt(epoch)
-            # true anomaly at epoch
-            ev_norm = self.ev / np.sqrt(np.dot(self.ev, self.ev))
-            nv_norm = nv / np.sqrt(np.dot(nv, nv))
-            pos_norm = pos / np.sqrt(np.dot(pos, pos))
+            T = epoch - pr * ma / (math.pi * 2.0)
             # true anomaly at epoch
-            self.ta0 = np.arctan2(np.dot(pos_norm, nv_norm), np.dot(pos_norm, ev_norm))
+            ta0 = _ta_at_epoch(epoch, T, a, e, self.mu)
         
-        # epoch
-        self.t0 = epoch
         # position and velocity at epoch
         if e != 0.0:
-            self.pos, self.vel = self.posvel(self.ta0)
+            PVt, QVt = _basis(evd, hv)
+            pos, vel = _posvel_ta_scalar(ta0, PVt, QVt, p, e, self.mu)
         else:
-            r = np.array([[math.cos(self.ta0)], [math.sin(self.ta0)], [0.0]]) * self.a
-            self.pos = (np.dot(R, r).T)[0]
-            v = np.array([[(-1.0)*math.sin(self.ta0)], [math.cos(self.ta0)], [0.0]]) * math.sqrt(self.mu / self.a)
-            self.vel = (np.dot(R, v).T)[0]
+            r = np.array([[math.cos(ta0)], [math.sin(ta0)], [0.0]]) * a
+            pos = (np.dot(R, r).T)[0]
+            v = np.array([[(-1.0)*math.sin(ta0)], [math.cos(ta0)], [0.0]]) * math.sqrt(self.mu / a)
+            vel = (np.dot(R, v).T)[0]
+        
+        # the orbit is marked as defined after all elements are set
+        self._setElements({'t0': epoch, 'a': a, 'e': e, 'i': inc, 'lan': lan,
+            'parg': parg, 'pr': pr, 'ma': ma, 'mm': mm, 'p': p, 'evd': evd,
+            'ev': evd * e, 'hv': hv, 'ta0': ta0, 'T': T, 'pos': pos,
+            'vel': vel})
     
-    def points(self, ndata):
+    def points(self, ndata, tol=None):
         """Returns points on orbital trajectory for visualization
         
         Args:
             ndata: Number of points
+            tol: Tolerance of distance (optional).  If specified, points are
+                 placed adaptively; segments between neighbouring points are
+                 divided until the trajectory deviates less than tol from
+                 each chord, so that strongly curved parts get more points.
+                 In this mode, ndata is the maximum number of points
         Returns: xs, ys, zs, times
             xs: Array of x-coordinates (Numpy array)
             ys: Array of y-coordinates (Numpy array)
@@ -380,84 +1736,161 @@ class TwoBodyOrbit:
         if not self._setOrb:
             raise(RuntimeError('Orbit has not been defined: TwoBodyOrbit.points'))
 
-        times = np.zeros(ndata)
-        xs = np.zeros(ndata)
-        ys = np.zeros(ndata)
-        zs = np.zeros(ndata)
-        tas = np.zeros(ndata)
-        
         if self.e < 1.0:
-            tas =np.linspace(0.0, math.pi * 2.0, ndata)
+            start = 0.0
+            stop = math.pi * 2.0
         else:
             stop = math.pi - np.arccos(1.0 / self.e)
             start = (-1.) * stop
             delta = (stop - start) / (ndata + 1)
-            tas = np.linspace(start + delta, stop - delta, ndata)
-        for j in range(ndata):
-            ta =tas[j]
-            times[j] = self.timeFperi(ta) + self.T
-            xyz, xdydzd =self.posvel(ta)
-            xs[j] = xyz[0]
-            ys[j] = xyz[1]
-            zs[j] = xyz[2]
+            start += delta
+            stop -= delta
+        
+        if tol is None:
+            tas = np.linspace(start, stop, ndata)
+            xyz, xdydzd = _posvel_ta(tas, self._PV, self._QV, self.p, self.e,
+                self.mu)
+        else:
+            tas, xyz = self._adaptivePoints(start, stop, ndata, tol)
+        times = _time_from_peri(tas, self.a, self.e, self.mu) + self.T
         
-        return xs, ys, zs, times
+        return xyz[:, 0].copy(), xyz[:, 1].copy(), xyz[:, 2].copy(), times
+
+    def _adaptivePoints(self, start, stop, ndata, tol):
+        """True anomalies and positions of adaptively placed points
+        
+        Starting from 9 points, midpoints (in true anomaly) are inserted
+        into segments whose midpoint deviates from the chord more than tol.
+        If the number of points would exceed ndata, segments of larger
+        deviation are divided first.
+        """
+        tas = np.linspace(start, stop, min(9, max(ndata, 2)))
+        xyz, xdydzd = _posvel_ta(tas, self._PV, self._QV, self.p, self.e,
+            self.mu)
+        while tas.size < ndata:
+            midta = (tas[:-1] + tas[1:]) / 2.0
+            midxyz, xdydzd = _posvel_ta(midta, self._PV, self._QV, self.p,
+                self.e, self.mu)
+            chord = xyz[1:] - xyz[:-1]
+            clen = np.sqrt(np.sum(chord * chord, axis=1))
+            dev = np.cross(midxyz - xyz[:-1], chord)
+            dev = np.sqrt(np.sum(dev * dev, axis=1)) / clen
+            split = np.flatnonzero(dev > tol)
+            if split.size == 0:
+                break
+            budget = ndata - tas.size
+            if split.size > budget:
+                split = split[np.argsort(dev[split])[::-1][:budget]]
+                split.sort()
+            tas = np.insert(tas, split + 1, midta[split])
+            xyz = np.insert(xyz, split + 1, midxyz[split], axis=0)
+        return tas, xyz
 
     def posvelatt(self, t):
         """Returns position and velocity of the object at given t
         
         Args:
-            t: Time
+            t: Time, or array-like object of times
         Returns: newpos, newvel
             newpos: Position of the object at t (x,y,z) (Numpy array)
             newvel: Velocity of the object at t (xd,yd,zd) (Numpy array)
+
+            If t is an array of N times, newpos and newvel are (N,3) arrays,
+            and Kepler's equation is solved for all of the times at once.
+            If the ephemeris cache is enabled (enableCache), times within
+            cached spans are answered by the Chebyshev polynomials.
         Exception:
             RuntimeError: If it failed to the computation, raises RuntimeError
             
             Origin of coordinates are position of the central body
         """
-        def _Cz(z):
-            if z < 0:
-                return (1.0 - np.cosh(np.sqrt((-1)*z))) / z
-            else:
-                return (1.0 - np.cos(np.sqrt(z))) / z
-            
-        def _Sz(z):
-            if z < 0:
-                sqz = np.sqrt((-1)*z)
-                return (np.sinh(sqz) - sqz) / sqz ** 3
-            else:
-                sqz = np.sqrt(z)
-                return (sqz - np.sin(sqz)) / sqz ** 3
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: TwoBodyOrbit.posvelatt'))
+
+        if self._cache is None:
+            return self._posvelattExact(t)
+        
+        if np.ndim(t) == 0:
+            cached = self._cache.posvel(t)
+            if cached is not None:
+                return cached
+            return self._posvelattExact(t)
+        
+        t = np.asarray(t, dtype=float)
+        newpos, newvel, hit = self._cache.posvelArray(t)
+        if not hit.all():
+            newpos[~hit], newvel[~hit] = self._posvelattExact(t[~hit])
+        return newpos, newvel
+
+    def _posvelattExact(self, t):
+        """posvelatt without the ephemeris cache"""
+        if _stats is None:
+            return self._posvelattSolve(t, None)
+        info = {'iterations':0, 'fevals':0, 'fallbacks':0}
+        start = time.perf_counter()
+        result = self._posvelattSolve(t, info)
+        _stats.record('posvelatt.' + self.solver, info['iterations'],
+            info['fevals'], info['fallbacks'], time.perf_counter() - start)
+        return result
+
+    def _posvelattSolve(self, t, info):
+        """Solves Kepler's equation for posvelatt; statistics are set into
+        info, unless info is None
+        """
+        # invariants of the orbit are cached by _setEpochInvariants
+        sr = self._sr0
+        sigma = self._sigma0
+        alpha = self._alpha
+        sqmu = self._sqmu
+        beta = 1.0 - sr * alpha
 
         def _func(xn, targett):
-            z = xn * xn / self.a
-            sr = np.sqrt(np.dot(self.pos, self.pos))
-            tn = (np.dot(self.pos, self.vel) / np.sqrt(self.mu) * xn * xn \
-                * _Cz(z) + (1.0 - sr / self.a) * xn ** 3 * _Sz(z) + sr * xn) \
-                / np.sqrt(self.mu) - targett
+            z = xn * xn * alpha
+            cz, sz = _stumpff(z)
+            tn = (sigma * xn * xn * cz + beta * xn ** 3 * sz + sr * xn) \
+                / sqmu - targett
             return tn
         
         def _fprime(x, targett):
-            z = x * x / self.a
-            sqmu = np.sqrt(self.mu)
-            sr = np.sqrt(np.dot(self.pos, self.pos))
-            dtdx = (x * x * _Cz(z) + np.dot(self.pos, self.vel) / sqmu * x \
-                * (1.0 - z * _Sz(z)) + sr * (1.0 - z * _Cz(z))) / sqmu
+            z = x * x * alpha
+            cz, sz = _stumpff(z)
+            dtdx = (x * x * cz + sigma * x * (1.0 - z * sz) + sr * (1.0 - z \
+                * cz)) / sqmu
             return dtdx
 
-        if not self._setOrb:
-            raise(RuntimeError('Orbit has not been defined: TwoBodyOrbit.posvelatt'))
+        if self.solver == 'anomaly':
+            if np.ndim(t) > 0:
+                return self._posvelAnomaly(np.asarray(t, dtype=float), info)
+            if t == self.t0:
+                return self.pos + 0.0, self.vel + 0.0
+            return self._posvelAnomaly(t, info)
+
+        if np.ndim(t) > 0:
+            delta_t = np.asarray(t, dtype=float) - self.t0
+            xn = _universal_anomaly(delta_t, self._sr0, self._sigma0 \
+                * self._sqmu, self.a, self.mu, info=info)
+            return _posvel_universal(self.pos, self.vel, delta_t, xn, self.a,
+                self.mu)
 
         delta_t = (t - self.t0)
         if delta_t == 0.0:
             return self.pos + 0.0, self.vel + 0.0
             # you should not return self.pos. it can cause trouble!
         x0 = np.sqrt(self.mu) * delta_t / self.a
+        from scipy.optimize import newton
         try:
             # compute with scipy.optimize.newton
-            xn = newton(_func, x0, args=(delta_t,), fprime=_fprime)
+            xn, res = newton(_func, x0, args=(delta_t,), fprime=_fprime,
+                full_output=True)
+            if info is not None:
+                info['iterations'] = res.iterations
+                info['fevals'] = res.function_calls
         except RuntimeError:
+            if info is not None:
+                # scipy.optimize.newton gave up after 50 iterations
+                info['iterations'] = 50
+                info['fevals'] = 100
+                info['fallbacks'] = 1
             # Configure boundaries for scipy.optimize.bisect
             # b1: Lower boundary
             # b2: Upper boundary
@@ -490,20 +1923,111 @@ class TwoBodyOrbit:
                     'velocity: TwoBodyOrbit.posvelatt'))
 
             # compute with scipy.optimize.bisect
-            xn = bisect(_func, b1, b2, args=(delta_t,), maxiter=200)
+            from scipy.optimize import bisect
+            xn, res = bisect(_func, b1, b2, args=(delta_t,), maxiter=200,
+                full_output=True)
+            if info is not None:
+                info['iterations'] += res.iterations
+                info['fevals'] += res.function_calls + i + 2
             
-        z = xn * xn / self.a
-        sr = np.sqrt(np.dot(self.pos, self.pos))
-        sqmu = np.sqrt(self.mu)
-        val_f = 1.0 - xn * xn / sr * _Cz(z)
-        val_g = delta_t - xn ** 3 / sqmu * _Sz(z)
+        return self._posvelUniversal(delta_t, xn)
+    
+    def _posvelUniversal(self, delta_t, xn):
+        """Position and velocity for a float universal anomaly at delta_t
+        from epoch, by f and g functions"""
+        sr = self._sr0
+        sqmu = self._sqmu
+        z = xn * xn * self._alpha
+        cz, sz = _stumpff(z)
+        val_f = 1.0 - xn * xn / sr * cz
+        val_g = delta_t - xn ** 3 / sqmu * sz
         newpos = self.pos * val_f + self.vel * val_g
         newr = np.sqrt(np.dot(newpos, newpos))
-        val_fd = sqmu / sr / newr * xn * (z * _Sz(z) - 1.0)
-        val_gd = 1.0 - xn * xn / newr * _Cz(z)
+        val_fd = sqmu / sr / newr * xn * (z * sz - 1.0)
+        val_gd = 1.0 - xn * xn / newr * cz
         newvel = self.pos * val_fd + self.vel * val_gd
         return newpos, newvel
     
+    def stmatt(self, t):
+        """Returns position, velocity, and state transition matrix at given t
+        
+        Args:
+            t: Time, or array-like object of times
+        Returns: newpos, newvel, stm
+            newpos: Position of the object at t (x,y,z) (Numpy array)
+            newvel: Velocity of the object at t (xd,yd,zd) (Numpy array)
+            stm: State transition matrix from epoch to t, (6,6) Numpy
+                 array; partial derivatives of (x,y,z,xd,yd,zd) at t with
+                 respect to those at epoch
+            
+            If t is an array of N times, newpos and newvel are (N,3) arrays,
+            and stm is an (N,6,6) array.
+            Universal anomaly is solved once for each time, and shared by
+            position, velocity, and the analytic state transition matrix
+            (regardless of the solver attribute and the ephemeris cache).
+        Exception:
+            RuntimeError: If it failed to the computation, raises RuntimeError
+            
+            Origin of coordinates are position of the central body
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: TwoBodyOrbit.stmatt'))
+        
+        info = None
+        if _stats is not None:
+            info = {'iterations':0, 'fevals':0, 'fallbacks':0}
+            start = time.perf_counter()
+        delta_t = np.asarray(t, dtype=float) - self.t0
+        xn = _universal_anomaly(delta_t, self._sr0, self._sigma0 \
+            * self._sqmu, self.a, self.mu, info=info)
+        result = _stm_universal(self.pos, self.vel, delta_t, xn, self.a,
+            self.mu)
+        if info is not None:
+            _stats.record('stmatt', info['iterations'], info['fevals'],
+                info['fallbacks'], time.perf_counter() - start)
+        return result
+    
+    def enableCache(self, rtol=1e-11, maxsegments=4096, degree=16):
+        """Enables the Chebyshev ephemeris cache
+        
+        After cacheSpan() is called for time spans, posvelatt answers
+        queries within the spans by evaluating piecewise Chebyshev
+        polynomials instead of solving Kepler's equation. Queries outside
+        cached spans are computed by the exact solver.  The cache is cleared
+        when the orbit is redefined.
+        
+        Args:
+            rtol: Accuracy target of the polynomials; errors of position and
+                  velocity are smaller than rtol times their magnitudes
+            maxsegments: Maximum number of polynomial segments; least
+                         recently used segments are evicted beyond this
+            degree: Degree of Chebyshev polynomials
+        """
+        self._cache = _ChebyshevCache(rtol, maxsegments, degree)
+        
+    def disableCache(self):
+        """Disables the Chebyshev ephemeris cache, and discards it"""
+        self._cache = None
+        
+    def cacheSpan(self, t1, t2):
+        """Fits Chebyshev polynomials of the ephemeris from t1 to t2
+        
+        Args:
+            t1: Start time of the span
+            t2: End time of the span
+        Exception:
+            RuntimeError: If the cache is not enabled, raises RuntimeError
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: TwoBodyOrbit.cacheSpan'))
+        if self._cache is None:
+            raise(RuntimeError('Cache is not enabled: TwoBodyOrbit.cacheSpan'))
+        if self.e < 1.0:
+            span = self.pr / 8.0
+        else:
+            span = math.pi / 4.0 / self._nmean
+        self._cache.fit(self._posvelattExact, self.t0, span, t1, t2)
+
     def elmKepl(self):
         """Returns Classical orbital element
         
@@ -556,48 +2080,482 @@ class TwoBodyOrbit:
             
         return kepl
 
-def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True):
+
+class FrozenOrbit(TwoBodyOrbit):
+    """An immutable two-body orbit
+    
+    A FrozenOrbit is created by fromCart, fromKepl, or fromOrbit, and it
+    cannot be redefined; attributes cannot be assigned, and Numpy array
+    attributes are read-only.  The ephemeris cache is not available.
+    Because no method modifies the instance, one FrozenOrbit can be shared
+    by threads (or asyncio tasks) without locks.  Other methods are the
+    same as those of TwoBodyOrbit.
+    """
+    def __init__(self, *args, **kwargs):
+        raise(TypeError('Use FrozenOrbit.fromCart, fromKepl, or fromOrbit'))
+    
+    @classmethod
+    def fromCart(cls, t, pos, vel, bname='object', mname='Sun',
+                 mu=1.32712440041e20, solver='anomaly'):
+        """Returns a FrozenOrbit defined by epoch, position, and velocity
+        
+        Args:
+            t, pos, vel: see TwoBodyOrbit.setOrbCart
+            bname, mname, mu, solver: see TwoBodyOrbit
+        """
+        orbit = TwoBodyOrbit(bname, mname, mu, solver)
+        orbit.setOrbCart(t, pos, vel)
+        return cls.fromOrbit(orbit)
+    
+    @classmethod
+    def fromKepl(cls, epoch, a, e, i, LoAN, AoP, TA=None, T=None, MA=None,
+                 bname='object', mname='Sun', mu=1.32712440041e20,
+                 solver='anomaly'):
+        """Returns a FrozenOrbit defined by classical orbital elements
+        
+        Args:
+            epoch, a, e, i, LoAN, AoP, TA, T, MA: see TwoBodyOrbit.setOrbKepl
+            bname, mname, mu, solver: see TwoBodyOrbit
+        """
+        orbit = TwoBodyOrbit(bname, mname, mu, solver)
+        orbit.setOrbKepl(epoch, a, e, i, LoAN, AoP, TA=TA, T=T, MA=MA)
+        return cls.fromOrbit(orbit)
+    
+    @classmethod
+    def fromOrbit(cls, orbit):
+        """Returns a FrozenOrbit with a copy of the orbit of a TwoBodyOrbit
+        
+        Args:
+            orbit: TwoBodyOrbit instance of which orbit has been defined
+        """
+        if not orbit._setOrb:
+            raise(RuntimeError('Orbit has not been defined: in FrozenOrbit.fromOrbit'))
+        return cls._fromState(orbit.__dict__)
+    
+    @classmethod
+    def _fromState(cls, state):
+        frozen = object.__new__(cls)
+        for key, value in state.items():
+            if isinstance(value, np.ndarray):
+                value = value.copy()
+                value.setflags(write=False)
+            frozen.__dict__[key] = value
+        frozen.__dict__['_cache'] = None
+        return frozen
+    
+    def __reduce__(self):
+        # arrays are made read-only again when unpickled
+        return (FrozenOrbit._fromState, (self.__dict__,))
+    
+    def __setattr__(self, name, value):
+        raise(AttributeError('FrozenOrbit is immutable'))
+    
+    def __delattr__(self, name):
+        raise(AttributeError('FrozenOrbit is immutable'))
+    
+    def setOrbCart(self, t, pos, vel):
+        raise(RuntimeError('FrozenOrbit cannot be redefined: use FrozenOrbit.fromCart'))
+    
+    def setOrbKepl(self, epoch, a, e, i, LoAN, AoP, TA=None, T=None, MA=None):
+        raise(RuntimeError('FrozenOrbit cannot be redefined: use FrozenOrbit.fromKepl'))
+    
+    def enableCache(self, rtol=1e-11, maxsegments=4096, degree=16):
+        raise(RuntimeError('Cache is not available for FrozenOrbit'))
+    
+    def disableCache(self):
+        pass
+    
+    def cacheSpan(self, t1, t2):
+        raise(RuntimeError('Cache is not available for FrozenOrbit'))
+
+
+class OrbitSet:
+    """A class of a set of two-body orbits around one central body
+    
+    Orbital elements of all members are stored as Numpy arrays (one element
+    per member), so that the whole set is propagated in one vectorized
+    computation.  Array attributes have the same names and meanings as
+    attributes of TwoBodyOrbit:
+        t0, pos, vel, a, e, i, lan, parg, ta0, T, ma, pr, mm, p, hv, ev, evd
+    For hyperbolic members, ma, pr, and mm are nan.
+    """
+    def __init__(self, mname='Sun', mu=1.32712440041e20):
+        """
+        Args:
+            mname: Name of the central body
+            mu : Gravitational parameter (mu) of the central body
+                Default value is gravitational parameter of the Sun.
+        """
+        self._setOrb = False
+        self.mothername = mname
+        self.mu = mu
+        self.n = 0
+    
+    def __len__(self):
+        return self.n
+    
+    def setOrbCart(self, t, pos, vel):
+        """Define the orbits by epochs, positions, and velocities
+        
+        Args:
+            t: Epoch, or array of epochs (one for each member)
+            pos: Positions, (N,3) array-like object
+            vel: Velocities, (N,3) array-like object
+        
+        Exceptions:
+            ValueError: when angular momentum of a member is zero, or e of
+                a member becomes 1.0, the method raises ValueError
+        """
+        self._setOrb = False
+        self._setElements(_cart_elements(t, pos, vel, self.mu,
+            'OrbitSet.setOrbCart'))
+
+    def setOrbKepl(self, epoch, a, e, i, LoAN, AoP, TA=None, T=None, MA=None):
+        """Define the orbits by classical orbital elements
+        
+        Arguments are the same as TwoBodyOrbit.setOrbKepl, but each of them
+        may be an array with one element for each member.  TA, T, and MA
+        are mutually exclusive; if TA is specified, other arguments will be
+        ignored, and if T is specified, MA will be ignored.
+        
+        Exceptions:
+            ValueError: If classical orbital element(s) of a member are
+                inconsistent, the method raises ValueError
+        """
+        self._setOrb = False
+        self._setElements(_kepl_elements(epoch, a, e, i, LoAN, AoP, TA, T, MA,
+            self.mu, 'OrbitSet.setOrbKepl'))
+
+    def _setElements(self, elm):
+        for key, value in elm.items():
+            setattr(self, key, value)
+        self.n = self.a.shape[0]
+        self._setOrb = True
+
+    def setOrbList(self, orbits):
+        """Define the orbits from a sequence of TwoBodyOrbit instances
+        
+        Args:
+            orbits: Sequence of TwoBodyOrbit instances; all of them should
+                    have the same gravitational parameter as this set
+        """
+        for orbit in orbits:
+            if not orbit._setOrb:
+                raise(RuntimeError('Orbit has not been defined: in OrbitSet.setOrbList'))
+            if orbit.mu != self.mu:
+                raise(ValueError('Inconsistent mu in OrbitSet.setOrbList'))
+        self.setOrbCart([orbit.t0 for orbit in orbits],
+            [orbit.pos for orbit in orbits], [orbit.vel for orbit in orbits])
+
+    def orbit(self, k, bname='object'):
+        """Returns a TwoBodyOrbit instance of the k-th member
+        
+        Args:
+            k: Index of the member
+            bname: Name of the object
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: in OrbitSet.orbit'))
+        orbit = TwoBodyOrbit(bname, mname=self.mothername, mu=self.mu)
+        orbit.setOrbCart(self.t0[k], self.pos[k], self.vel[k])
+        return orbit
+
+    def posvelatt(self, t):
+        """Returns positions and velocities of all members at given t
+        
+        Args:
+            t: Time, or 1-D array-like object of M times
+        Returns: newpos, newvel
+            newpos: Positions, (N,3) Numpy array, or (N,M,3) for M times
+            newvel: Velocities, (N,3) Numpy array, or (N,M,3) for M times
+        Exception:
+            RuntimeError: If it failed to the computation, raises RuntimeError
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: in OrbitSet.posvelatt'))
+        
+        pos, vel, delta_t, a, xn, info = self._solve(t)
+        result = _posvel_universal(pos, vel, delta_t, xn, a, self.mu)
+        self._record(info)
+        return result
+
+    def stmatt(self, t):
+        """Returns positions, velocities, and state transition matrices of
+        all members at given t
+        
+        Args:
+            t: Time, or 1-D array-like object of M times
+        Returns: newpos, newvel, stm
+            newpos: Positions, (N,3) Numpy array, or (N,M,3) for M times
+            newvel: Velocities, (N,3) Numpy array, or (N,M,3) for M times
+            stm: State transition matrices from epochs of the members,
+                 (N,6,6) Numpy array, or (N,M,6,6) for M times (see
+                 TwoBodyOrbit.stmatt)
+        Exception:
+            RuntimeError: If it failed to the computation, raises RuntimeError
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: in OrbitSet.stmatt'))
+        
+        pos, vel, delta_t, a, xn, info = self._solve(t)
+        result = _stm_universal(pos, vel, delta_t, xn, a, self.mu)
+        self._record(info)
+        return result
+
+    def covarianceatt(self, t, cov, chunksize=4096):
+        """Propagates covariances of states of all members to given t
+        
+        Covariances are propagated by the state transition matrices as
+        stm @ cov @ stm.T.  Members are processed in chunks, so that
+        temporary memory is bounded by chunksize rather than by N.
+        Args:
+            t: Time
+            cov: Covariances of states (x,y,z,xd,yd,zd) of the members at
+                 their epochs, (N,6,6) array-like object, or (6,6) for a
+                 covariance shared by all members
+            chunksize: Number of members processed at once
+        Returns: newpos, newvel, newcov
+            newpos: Positions, (N,3) Numpy array
+            newvel: Velocities, (N,3) Numpy array
+            newcov: Covariances of states at t, (N,6,6) Numpy array
+        Exception:
+            ValueError: If shape of cov is inappropriate, raises ValueError
+            RuntimeError: If it failed to the computation, raises RuntimeError
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: in OrbitSet.covarianceatt'))
+        cov = np.asarray(cov, dtype=float)
+        if cov.shape not in ((6, 6), (self.n, 6, 6)):
+            raise(ValueError('Shape of cov is inappropriate: in OrbitSet.covarianceatt'))
+        cov = np.broadcast_to(cov, (self.n, 6, 6))
+        
+        newpos = np.empty((self.n, 3))
+        newvel = np.empty((self.n, 3))
+        newcov = np.empty((self.n, 6, 6))
+        for start in range(0, self.n, chunksize):
+            members = slice(start, start + chunksize)
+            pos, vel, delta_t, a, xn, info = self._solve(t, members)
+            newpos[members], newvel[members], stm = _stm_universal(pos, vel,
+                delta_t, xn, a, self.mu)
+            self._record(info)
+            pcov = stm @ cov[members] @ stm.swapaxes(-1, -2)
+            # symmetrized against round-off
+            newcov[members] = (pcov + pcov.swapaxes(-1, -2)) / 2.0
+        return newpos, newvel, newcov
+
+    def eventTimes(self, kind, t1, t2, radius=None):
+        """Computes times of an event of all members between t1 and t2
+        
+        Args:
+            kind: Kind of the event (see TwoBodyOrbit.eventTimes)
+            t1: Start time of the interval
+            t2: End time of the interval
+            radius: Distance from the central body, or array of N distances
+                    (for radius events)
+        Returns: index, times
+            index: Indices of members, Numpy array of integers
+            times: Times of the event, Numpy array
+            
+            Events are sorted by index, and by time for each member.
+        Exception:
+            ValueError: If kind is invalid, or radius is not given for
+                        radius events, raises ValueError
+        """
+        if not self._setOrb:
+            raise(RuntimeError('Orbit has not been defined: in OrbitSet.eventTimes'))
+        
+        index = []
+        times = []
+        for ta in _event_anomalies(kind, self.e, self.p, self.parg, self.i,
+                radius):
+            idx, tms = _event_times(ta, self.T, self.pr, self.a, self.e,
+                self.mu, t1, t2)
+            index.append(idx)
+            times.append(tms)
+        index = np.concatenate(index)
+        times = np.concatenate(times)
+        order = np.lexsort((times, index))
+        return index[order], times[order]
+
+    def _solve(self, t, members=slice(None)):
+        """Solves universal anomaly of members at given t
+        
+        Returns pos, vel, delta_t, a, and universal anomaly, shaped for
+        _posvel_universal and _stm_universal, and statistics of the solver
+        (dictionary for _record, or None if no SolverStats is activated).
+        """
+        t = np.asarray(t, dtype=float)
+        if t.ndim == 0:
+            pos = self.pos[members]
+            vel = self.vel[members]
+            delta_t = t - self.t0[members]
+            a = self.a[members]
+        else:
+            pos = self.pos[members, None, :]
+            vel = self.vel[members, None, :]
+            delta_t = t[None, :] - self.t0[members, None]
+            a = self.a[members, None]
+        sr = np.sqrt(np.sum(pos * pos, axis=-1))
+        info = None
+        if _stats is not None:
+            info = {'iterations':0, 'fevals':0, 'fallbacks':0,
+                    'start':time.perf_counter()}
+        xn = _universal_anomaly(delta_t, sr, np.sum(pos * vel, axis=-1), a,
+            self.mu, info=info)
+        return pos, vel, delta_t, a, xn, info
+    
+    @staticmethod
+    def _record(info):
+        """Records statistics returned by _solve, as 'orbitset'"""
+        if info is not None:
+            _stats.record('orbitset', info['iterations'], info['fevals'],
+                info['fallbacks'], time.perf_counter() - info['start'])
+
+
+KEPL_DTYPE = np.dtype([('epoch', float), ('a', float), ('e', float),
+    ('i', float), ('LoAN', float), ('AoP', float), ('TA', float),
+    ('T', float), ('MA', float), ('n', float), ('P', float)])
+CART_DTYPE = np.dtype([('epoch', float), ('pos', float, (3,)),
+    ('vel', float, (3,))])
+
+
+def cart_to_kepl(t, pos, vel, mu=1.32712440041e20):
+    """Converts positions and velocities into classical orbital elements
+    
+    Vectorized counterpart of TwoBodyOrbit.setOrbCart followed by elmKepl,
+    with the same handling of circular, equatorial, and hyperbolic orbits.
+    Args:
+        t: Epoch, or array of N epochs
+        pos: Positions, (N,3) array-like object
+        vel: Velocities, (N,3) array-like object
+        mu: Gravitational parameter of the central body
+    Returns: kepl
+        kepl: Structured Numpy array of N elements with dtype KEPL_DTYPE;
+              fields have the same names and units as keys of the
+              dictionary returned by TwoBodyOrbit.elmKepl.  Fields 'MA',
+              'n', and 'P' are nan for hyperbolic trajectories.
+    Exception:
+        ValueError: If angular momentum of a state is zero, or e becomes
+                    1.0, raises ValueError
+    """
+    elm = _cart_elements(t, pos, vel, mu, 'cart_to_kepl')
+    kepl = np.empty(elm['a'].shape[0], dtype=KEPL_DTYPE)
+    kepl['epoch'] = elm['t0']
+    kepl['a'] = elm['a']
+    kepl['e'] = elm['e']
+    kepl['i'] = np.degrees(elm['i'])
+    kepl['LoAN'] = np.degrees(elm['lan'])
+    kepl['AoP'] = np.degrees(elm['parg'])
+    kepl['TA'] = np.degrees(elm['ta0'])
+    kepl['T'] = elm['T']
+    kepl['MA'] = np.degrees(elm['ma'])
+    kepl['n'] = np.degrees(elm['mm'])
+    kepl['P'] = elm['pr']
+    return kepl
+
+
+def kepl_to_cart(epoch, a=None, e=None, i=None, LoAN=None, AoP=None, TA=None,
+                 T=None, MA=None, mu=1.32712440041e20):
+    """Converts classical orbital elements into positions and velocities
+    
+    Vectorized counterpart of TwoBodyOrbit.setOrbKepl, with the same
+    handling of circular, equatorial, and hyperbolic orbits.
+    Args:
+        epoch, a, e, i, LoAN, AoP, TA, T, MA: Arguments of
+            TwoBodyOrbit.setOrbKepl; each of them may be an array with one
+            element for each orbit.  TA, T, and MA are mutually exclusive.
+            
+            Alternatively, epoch may be a structured array returned by
+            cart_to_kepl; then epoch, a, e, i, LoAN, AoP, and TA are taken
+            from its fields, and other arguments except mu are ignored.
+        mu: Gravitational parameter of the central body
+    Returns: cart
+        cart: Structured Numpy array of N elements with dtype CART_DTYPE;
+              fields are 'epoch', 'pos' (x,y,z), and 'vel' (xd,yd,zd)
+    Exception:
+        ValueError: If classical orbital element(s) are inconsistent,
+                    raises ValueError
+    """
+    if getattr(epoch, 'dtype', None) is not None and epoch.dtype.names:
+        kepl = epoch
+        elm = _kepl_elements(kepl['epoch'], kepl['a'], kepl['e'], kepl['i'],
+            kepl['LoAN'], kepl['AoP'], kepl['TA'], None, None, mu,
+            'kepl_to_cart')
+    else:
+        elm = _kepl_elements(epoch, a, e, i, LoAN, AoP, TA, T, MA, mu,
+            'kepl_to_cart')
+    cart = np.empty(elm['a'].shape[0], dtype=CART_DTYPE)
+    cart['epoch'] = elm['t0']
+    cart['pos'] = elm['pos']
+    cart['vel'] = elm['vel']
+    return cart
+
+
+def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True, nrev=0,
+            z0=None, bracket=None, full_output=False):
     """A function to solve 'Lambert's Problem'
     
     From given initial position, terminal position, and flight time, 
     compute initial velocity and terminal velocity.
-    Args: ipos, tpos, targett, mu, ccw
+    Args: ipos, tpos, targett, mu, ccw, nrev
         ipos: Initial position of the object (x,y,z) (array-like object)
         tpos: Terminal position of the object (x,y,z) (array-like object)
         targett: Flight time
         mu: Gravitational parameter of the central body (default value is for the Sun)
         ccw: Flag for orbital direction. If True, counter clockwise
-    Returns: ivel, tvel
+        nrev: Number of complete revolutions (default is 0)
+        z0: Initial guess of universal variable z (optional), such as z of
+            the solution of a neighbouring problem
+        bracket: Lower and upper boundaries of z, (zlow, zhigh) (optional)
+        full_output: If True, z of the solution is also returned
+    Returns: ivel, tvel (, z) (nrev == 0)
         ivel: Initial velocity of the object (xd,yd,zd) as Numpy array
         tvel: Terminal velocity of the object (xd,yd,zd) as Numpy array
+        z: Universal variable z of the solution; only if full_output is True
+    Returns: solutions (nrev >= 1)
+        solutions: List of (ivel, tvel) (or (ivel, tvel, z) if full_output
+                   is True) of feasible branches; the left branch comes
+                   first (see lambert_multirev). The list is empty if the
+                   flight time is shorter than the minimum flight time of
+                   nrev revolutions
     Exception:
         ValueError: When input data (ipos, tpos, targett) are inappropriate,
                     the function raises ValueError
                     
         Origin of coordinates are position of the central body
+        
+        With z0 or bracket (nrev == 0), the solution is computed by a few
+        Newton steps safeguarded by the bracket, instead of searching
+        boundaries from scratch. If the steps fail, the function falls back
+        to the search.
     """
     
-    def _Cz(z):
-        if z < 0:
-            return (1.0 - np.cosh(np.sqrt((-1)*z))) / z
-        else:
-            return (1.0 - np.cos(np.sqrt(z))) / z
-            
-    def _Sz(z):
-        if z < 0:
-            sqz = np.sqrt((-1)*z)
-            return (np.sinh(sqz) - sqz) / sqz ** 3
-        else:
-            sqz = np.sqrt(z)
-            return (sqz - np.sin(sqz)) / sqz ** 3
-
     def _func(z, targett, r1pr2, A, mu):
-        val_y = r1pr2 - A * (1.0 - z * _Sz(z)) / np.sqrt(_Cz(z))
-        val_x = np.sqrt(val_y / _Cz(z))
-        t = (val_x ** 3 * _Sz(z) + A * np.sqrt(val_y)) / np.sqrt(mu)
+        cz, sz = _stumpff(z)
+        val_y = r1pr2 - A * (1.0 - z * sz) / np.sqrt(cz)
+        val_x = np.sqrt(val_y / cz)
+        t = (val_x ** 3 * sz + A * np.sqrt(val_y)) / np.sqrt(mu)
 
         return t - targett
 
+    def _result(zn, niter, nfev, fallbacks):
+        czn, szn = _stumpff(zn)
+        val_y = r1pr2 - A * (1.0 - zn * szn) / np.sqrt(czn)
+        val_f = 1.0 - val_y / r1
+        val_g = A * np.sqrt(val_y / mu)
+        val_gd = 1.0 - val_y / r2
+        
+        ivel = (stpos - val_f * sipos) / val_g
+        tvel = (val_gd * stpos - sipos) / val_g
+        
+        if _stats is not None:
+            _stats.record('lambert', niter, nfev, fallbacks,
+                time.perf_counter() - start)
+        if full_output:
+            return ivel, tvel, zn
+        return ivel, tvel
+
+    start = time.perf_counter() if _stats is not None else 0.0
     sipos = np.array(ipos)
     stpos = np.array(tpos)
     tsec = targett * 1.0
@@ -631,6 +2589,36 @@ def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True):
         raise(ValueError('Two points are placed opposite each' +
                             ' other: pytwobodyorbit.lambert'))
     
+    if nrev > 0:
+        zleft, zright, feasible, niter, nfev = _lambert_branches(nrev,
+            np.array([tsec]), np.array([r1pr2]), np.array([A]), mu,
+            np.array([True]))
+        solutions = []
+        if feasible[0]:
+            ivel, tvel = _lambert_velocity(np.array([zleft[0], zright[0]]),
+                np.array([sipos, sipos]), np.array([stpos, stpos]), r1, r2,
+                A, r1pr2, mu)
+            solutions = [(ivel[0], tvel[0]), (ivel[1], tvel[1])]
+            if full_output:
+                solutions = [(ivel[0], tvel[0], zleft[0]),
+                             (ivel[1], tvel[1], zright[0])]
+        if _stats is not None:
+            _stats.record('lambert', niter, nfev, 0,
+                time.perf_counter() - start)
+        return solutions
+    
+    wfev = 0
+    fallbacks = 0
+    if z0 is not None or bracket is not None:
+        zw, converged, niter, wfev = _lambert_seed(
+            None if z0 is None else np.array([z0]),
+            None if bracket is None else np.array([bracket]),
+            np.array([tsec]), np.array([r1pr2]), np.array([A]), mu,
+            np.array([True]))
+        if converged[0]:
+            return _result(zw[0], niter, wfev, 0)
+        fallbacks = 1
+    
     # Configure boundaries for scipy.optimize.bisect
     # b1: Lower boundary
     # b2: Upper boundary
@@ -646,7 +2634,11 @@ def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True):
             if test > 0.0:
                 found = True
                 break
+    nfev = wfev + i + 1
     if not found:
+        if _stats is not None:
+            _stats.record('lambert', 0, nfev, fallbacks,
+                time.perf_counter() - start)
         raise(ValueError("Could not solve Lambert's Plobrem: pytwobodyorbit.lambert"))        
     
     # configure b1, and b2
@@ -665,19 +2657,456 @@ def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True):
                 break
         else:
             b1 = (b1 + lastb1) /2.0
+    nfev += i + 1
     if not found:
+        if _stats is not None:
+            _stats.record('lambert', 0, nfev, fallbacks,
+                time.perf_counter() - start)
         raise(ValueError("Could not solve Lambert's Plobrem: pytwobodyorbit.lambert"))        
     
-    zn = bisect(_func, b1, b2, args=(tsec, r1pr2, A, mu), maxiter=100)
+    from scipy.optimize import bisect
+    zn, res = bisect(_func, b1, b2, args=(tsec, r1pr2, A, mu), maxiter=100,
+        full_output=True)
+
+    return _result(zn, res.iterations, nfev + res.function_calls, fallbacks)
 
-    val_y = r1pr2 - A * (1.0 - zn * _Sz(zn)) / np.sqrt(_Cz(zn))
-    val_f = 1.0 - val_y / r1
-    val_g = A * np.sqrt(val_y / mu)
-    val_gd = 1.0 - val_y / r2
     
-    ivel = (stpos - val_f * sipos) / val_g
-    tvel = (val_gd * stpos - sipos) / val_g
+# Status codes of lambert_batch
+LAMBERT_OK = 0              # solved
+LAMBERT_SMALL_DNU = 1       # difference in true anomaly is too small
+LAMBERT_OPPOSITE = 2        # two points are placed opposite each other
+LAMBERT_NO_SOLUTION = 3     # could not solve Lambert's problem
+
+
+def _lambert_tof(z, r1pr2, A, mu):
+    """Flight time for arrays of z of the universal-variable Lambert problem
     
+    Returns nan where z is out of the domain.
+    """
+    with np.errstate(all='ignore'):
+        cz, sz = _stumpff(z)
+        val_y = r1pr2 - A * (1.0 - z * sz) / np.sqrt(cz)
+        val_x = np.sqrt(val_y / cz)
+        return (val_x ** 3 * sz + A * np.sqrt(val_y)) / np.sqrt(mu)
+
+
+def _lambert_tof_prime(z, r1pr2, A, mu):
+    """Flight time and its derivative by z for arrays of z
+    
+    Returns nan where z is out of the domain.
+    """
+    with np.errstate(all='ignore'):
+        cz, sz = _stumpff(z)
+        val_y = r1pr2 - A * (1.0 - z * sz) / np.sqrt(cz)
+        val_x = np.sqrt(val_y / cz)
+        sqy = np.sqrt(val_y)
+        t = (val_x ** 3 * sz + A * sqy) / np.sqrt(mu)
+        # the general form cancels near z == 0, where its limit is taken
+        small = np.abs(z) < 1e-6
+        zs = np.where(small, 1.0, z)
+        dt = np.where(small,
+            math.sqrt(2.0) / 40.0 * val_y ** 1.5 + A / 8.0 * (sqy + A
+                * np.sqrt(0.5 / val_y)),
+            val_x ** 3 * ((cz - 1.5 * sz / cz) / (2.0 * zs) + 0.75 * sz * sz
+                / cz) + A / 8.0 * (3.0 * sz / cz * sqy + A / val_x))
+        return t, dt / np.sqrt(mu)
+
+
+def _lambert_geometry(sipos, stpos, ccw):
+    """Geometry of arrays of Lambert's problems
+    
+    Returns r1, r2, A, r1pr2, dnu, and status codes of the problems. The
+    geometry does not depend on flight time or number of revolutions, so
+    that it is computed once for all branches of a problem.
+    """
+    r1 = np.sqrt(np.sum(sipos * sipos, axis=1))
+    r2 = np.sqrt(np.sum(stpos * stpos, axis=1))
+
+    r1cr2 = np.cross(sipos, stpos)
+    r1dr2 = np.sum(sipos * stpos, axis=1)
+    sindnu = np.sqrt(np.sum(r1cr2 * r1cr2, axis=1)) / r1 / r2
+    sindnu = np.where(r1cr2[:, 2] < 0.0, (-1) * sindnu, sindnu)
+    sindnu = np.where(ccw, sindnu, (-1) * sindnu)
+    
+    cosdnu = r1dr2 / r1 / r2
+    with np.errstate(all='ignore'):
+        A = np.sqrt(r1 * r2) * sindnu / np.sqrt(1.0 - cosdnu)
+    r1pr2 = r1 + r2
+    
+    dnu = np.arctan2(sindnu, cosdnu)
+    dnu = np.where(dnu < 0.0, dnu + math.pi * 2.0, dnu)
+    
+    # Check difference of true anomaly of two points (same thresholds as
+    # lambert)
+    status = np.full(sipos.shape[0], LAMBERT_OK)
+    status[(dnu - math.pi) ** 2 < 0.00001 ** 2] = LAMBERT_OPPOSITE
+    status[(dnu < 0.001) | (dnu > (math.pi * 2.0 - 0.001))] = LAMBERT_SMALL_DNU
+    return r1, r2, A, r1pr2, dnu, status
+
+
+def _lambert_bisect(b1, b2, f1, tsec, r1pr2, A, mu, solve):
+    """Bisection of flight time equation between b1 and b2
+    
+    f1 is the residual of flight time at b1; the residual at b2 is not
+    evaluated, so that b2 may be a singular boundary. Tolerances are those
+    of scipy.optimize.bisect. Returns z, number of iterations, and number
+    of function evaluations.
+    """
+    nsolve = np.count_nonzero(solve)
+    nfev = 0
+    for i in range(100):
+        nfev += nsolve
+        zm = (b1 + b2) / 2.0
+        fm = _lambert_tof(zm, r1pr2, A, mu) - tsec
+        same = np.sign(fm) == np.sign(f1)
+        b1 = np.where(same, zm, b1)
+        f1 = np.where(same, fm, f1)
+        b2 = np.where(same, b2, zm)
+        if np.all((np.abs(b2 - b1) < 2e-12 + 8.881784197001252e-16 \
+            * np.abs(zm))[solve]):
+            break
+    return (b1 + b2) / 2.0, i + 1, nfev
+
+
+def _lambert_velocity(zn, sipos, stpos, r1, r2, A, r1pr2, mu):
+    """Initial and terminal velocities from solutions z of Lambert's problems"""
+    with np.errstate(all='ignore'):
+        czn, szn = _stumpff(zn)
+        val_y = r1pr2 - A * (1.0 - zn * szn) / np.sqrt(czn)
+        val_f = 1.0 - val_y / r1
+        val_g = A * np.sqrt(val_y / mu)
+        val_gd = 1.0 - val_y / r2
+        ivel = (stpos - val_f[:, None] * sipos) / val_g[:, None]
+        tvel = (val_gd[:, None] * stpos - sipos) / val_g[:, None]
     return ivel, tvel
 
-    
\ No newline at end of file
+
+def _lambert_zero_rev(tsec, r1pr2, A, dnu, mu, status):
+    """Solves zero-revolution Lambert's problems for z
+    
+    status is updated in place. Returns z, number of iterations, and number
+    of function evaluations.
+    """
+    # find b2 candidates; the first finite and positive one is taken
+    b2cand = (math.pi * 2.0) ** 2 - 1.0 / 10.0 ** np.arange(10)
+    test = _lambert_tof(b2cand[None, :], r1pr2[:, None], A[:, None], mu) \
+        - tsec[:, None]
+    nfev = test.size
+    good = np.isfinite(test) & (test > 0.0)
+    status[(status == LAMBERT_OK) & ~good.any(axis=1)] = LAMBERT_NO_SOLUTION
+    b2 = b2cand[np.argmax(good, axis=1)]
+    
+    # configure b1, and b2
+    minb1 = (-1.0) * (math.pi * 2.0) ** 2   # minimum limit for b1
+    b1 = (-1.0) * dnu ** 2
+    lastb1 = b2.copy()
+    active = status == LAMBERT_OK
+    for i in range(100):
+        if not active.any():
+            break
+        nfev += np.count_nonzero(active)
+        test = _lambert_tof(b1, r1pr2, A, mu) - tsec
+        valid = np.isfinite(test)
+        up = active & valid & (test > 0.0)
+        stop = active & valid & ~(test > 0.0)
+        bad = active & ~valid
+        lastb1 = np.where(up, b1, lastb1)
+        b1 = np.where(up, (b1 + minb1) / 2.0, b1)
+        b2 = np.where(stop, lastb1, b2)
+        b1 = np.where(bad, (b1 + lastb1) / 2.0, b1)
+        active &= ~stop
+    status[active] = LAMBERT_NO_SOLUTION
+    
+    solve = status == LAMBERT_OK
+    f1 = _lambert_tof(b1, r1pr2, A, mu) - tsec
+    nfev += np.count_nonzero(solve)
+    zn, niter, nbis = _lambert_bisect(b1, b2, f1, tsec, r1pr2, A, mu, solve)
+    return zn, niter, int(nfev + nbis)
+
+
+def _lambert_warm(z0, lo, hi, tsec, r1pr2, A, mu, solve, maxiter=20):
+    """Safeguarded Newton iteration of zero-revolution flight time equation
+    
+    Starts from initial guesses z0, and keeps brackets [lo, hi] of the
+    solutions. Steps which leave the bracket are replaced by bisection of
+    the bracket, and steps which leave the domain of flight time are
+    halved back toward the last valid point. An element fails if its
+    initial guess is out of the domain. Returns z, convergence flags,
+    number of iterations, and number of function evaluations.
+    """
+    z = np.where(solve, z0, np.nan)
+    zprev = np.full(z.shape, np.nan)
+    converged = np.zeros(z.shape, dtype=bool)
+    active = solve & np.isfinite(z)
+    niter = 0
+    nfev = 0
+    for i in range(maxiter):
+        if not active.any():
+            break
+        niter += 1
+        nfev += np.count_nonzero(active)
+        t, dt = _lambert_tof_prime(z, r1pr2, A, mu)
+        f = t - tsec
+        valid = active & np.isfinite(f) & (dt > 0.0)
+        retreat = active & ~valid & np.isfinite(zprev)
+        bad = active & ~valid & ~retreat
+        with np.errstate(all='ignore'):
+            lo = np.where(valid & (f < 0.0), z, lo)
+            hi = np.where(valid & (f > 0.0), z, hi)
+            znew = z - f / dt
+            done = valid & (np.abs(znew - z) < 2e-12 \
+                + 8.881784197001252e-16 * np.abs(znew))
+            outside = ~done & ~((znew > lo) & (znew < hi))
+            znew = np.where(outside, (lo + hi) / 2.0, znew)
+            bad |= valid & ~np.isfinite(znew)
+            done &= ~bad
+            zback = (z + zprev) / 2.0
+        zprev = np.where(valid, z, zprev)
+        z = np.where(valid & ~bad, znew, np.where(retreat, zback, z))
+        converged |= done
+        active &= ~(bad | done)
+    return z, converged, niter, nfev
+
+
+def _lambert_seed(z0, bracket, tsec, r1pr2, A, mu, solve):
+    """Warm start of zero-revolution Lambert's problems
+    
+    z0 is an array of initial guesses, and bracket is an (N,2) array of
+    lower and upper boundaries of z (nan for elements without them).
+    A bracket is used only if flight time changes sign across it; without
+    a bracket the upper boundary is (2*pi)**2. Returns z, convergence
+    flags, number of iterations, and number of function evaluations.
+    """
+    n = tsec.shape[0]
+    lo = np.full(n, -np.inf)
+    hi = np.full(n, (math.pi * 2.0) ** 2)
+    z = np.full(n, np.nan) if z0 is None else \
+        np.broadcast_to(np.asarray(z0, dtype=float), (n,)).copy()
+    nfev = 0
+    if bracket is not None:
+        bracket = np.broadcast_to(np.asarray(bracket, dtype=float), (n, 2))
+        given = solve & np.isfinite(bracket).all(axis=1)
+        f1 = _lambert_tof(bracket[:, 0], r1pr2, A, mu) - tsec
+        f2 = _lambert_tof(bracket[:, 1], r1pr2, A, mu) - tsec
+        nfev += 2 * np.count_nonzero(given)
+        valid = given & (f1 < 0.0) & (f2 > 0.0)
+        lo = np.where(valid, bracket[:, 0], lo)
+        hi = np.where(valid, bracket[:, 1], hi)
+        inside = (z > lo) & (z < hi)
+        z = np.where(valid & ~inside, (lo + hi) / 2.0, z)
+    z, converged, niter, nwarm = _lambert_warm(z, lo, hi, tsec, r1pr2, A,
+        mu, solve)
+    return z, converged, niter, nfev + nwarm
+
+
+def _lambert_branches(nrev, tsec, r1pr2, A, mu, solve):
+    """Solves nrev-revolution Lambert's problems for both branches
+    
+    For nrev >= 1, z of the solutions lies between (2*pi*nrev)**2 and
+    (2*pi*(nrev+1))**2, where flight time tends to infinity at both ends
+    and has one minimum. The minimum is located by golden-section search,
+    and the left branch (z below the minimum) and the right branch (z above
+    the minimum) are solved by bisection together.
+    Returns zleft, zright, feasibility flags, number of iterations, and
+    number of function evaluations.
+    """
+    lo = np.full(tsec.shape, (math.pi * 2.0 * nrev) ** 2)
+    hi = np.full(tsec.shape, (math.pi * 2.0 * (nrev + 1)) ** 2)
+    nsolve = np.count_nonzero(solve)
+    
+    # golden-section search of the minimum flight time
+    invphi = (math.sqrt(5.0) - 1.0) / 2.0
+    a = lo.copy()
+    b = hi.copy()
+    c = b - invphi * (b - a)
+    d = a + invphi * (b - a)
+    fc = _lambert_tof(c, r1pr2, A, mu)
+    fd = _lambert_tof(d, r1pr2, A, mu)
+    nfev = 2 * nsolve
+    for i in range(100):
+        if np.all((np.abs(b - a) < 2e-12 + 8.881784197001252e-16 \
+            * np.abs(c))[solve]):
+            break
+        nfev += nsolve
+        lower = fc < fd
+        b = np.where(lower, d, b)
+        a = np.where(lower, a, c)
+        x = np.where(lower, b - invphi * (b - a), a + invphi * (b - a))
+        fx = _lambert_tof(x, r1pr2, A, mu)
+        d, fd, c, fc = np.where(lower, c, x), np.where(lower, fc, fx), \
+            np.where(lower, x, d), np.where(lower, fx, fd)
+    niter = i + 1
+    zmin = np.where(fc < fd, c, d)
+    tmin = np.minimum(fc, fd)
+    feasible = solve & np.isfinite(tmin) & (tmin <= tsec)
+    
+    # both branches are bisected together from the minimum
+    zn, nbis, nfbis = _lambert_bisect(np.concatenate((zmin, zmin)),
+        np.concatenate((lo, hi)), np.concatenate((tmin, tmin)) \
+        - np.concatenate((tsec, tsec)), np.concatenate((tsec, tsec)),
+        np.concatenate((r1pr2, r1pr2)), np.concatenate((A, A)), mu,
+        np.concatenate((feasible, feasible)))
+    n = tsec.shape[0]
+    return zn[:n], zn[n:], feasible, niter + nbis, int(nfev + nfbis)
+
+
+def lambert_batch(ipos, tpos, targett, mu=1.32712440041e20, ccw=True,
+                  z0=None, bracket=None, full_output=False, fallback=True):
+    """A function to solve many 'Lambert's Problems' at once
+    
+    Vectorized counterpart of lambert().  All problems are solved together
+    by vectorized bracketing and bisection; instead of raising ValueError,
+    the function reports a status code for each problem.
+    Args: ipos, tpos, targett, mu, ccw
+        ipos: Initial positions of the objects, (N,3) array-like object
+        tpos: Terminal positions of the objects, (N,3) array-like object
+        targett: Flight times, array-like object of N elements (or a scalar)
+        mu: Gravitational parameter of the central body (default value is for the Sun)
+        ccw: Flag for orbital direction, or array of N flags. If True,
+             counter clockwise
+        z0: Initial guesses of z, array-like object of N elements (optional;
+            nan for problems without guess)
+        bracket: Lower and upper boundaries of z, (N,2) array-like object
+                 (optional; nan for problems without bracket)
+        full_output: If True, z of the solutions is also returned
+        fallback: If False, problems with a guess or a bracket for which the
+                  Newton steps fail are not solved again from scratch, and
+                  their status is LAMBERT_NO_SOLUTION
+    Returns: ivel, tvel, status (, z)
+        ivel: Initial velocities of the objects, (N,3) Numpy array
+        tvel: Terminal velocities of the objects, (N,3) Numpy array
+        status: Status codes, Numpy array of N integers
+            LAMBERT_OK: Solved
+            LAMBERT_SMALL_DNU: Difference in true anomaly is too small
+            LAMBERT_OPPOSITE: Two points are placed opposite each other
+            LAMBERT_NO_SOLUTION: Could not solve Lambert's problem
+            ivel and tvel are nan for unsolved problems.
+        z: Universal variable z of the solutions, Numpy array of N elements
+           (nan for unsolved problems); only if full_output is True
+        
+        Problems with a guess or a bracket are solved by a few safeguarded
+        Newton steps (see lambert); the others, and those for which the
+        steps fail, are solved by bracketing and bisection.
+        
+        Origin of coordinates are position of the central body
+    """
+    start = time.perf_counter() if _stats is not None else 0.0
+    sipos = np.array(ipos, dtype=float).reshape(-1, 3)
+    stpos = np.array(tpos, dtype=float).reshape(-1, 3)
+    n = sipos.shape[0]
+    tsec = np.broadcast_to(np.asarray(targett, dtype=float), (n,))
+    ccw = np.broadcast_to(np.asarray(ccw, dtype=bool), (n,))
+    
+    r1, r2, A, r1pr2, dnu, status = _lambert_geometry(sipos, stpos, ccw)
+    solve = status == LAMBERT_OK
+    if z0 is None and bracket is None:
+        zn, niter, nfev = _lambert_zero_rev(tsec, r1pr2, A, dnu, mu, status)
+        fallbacks = 0
+    else:
+        zn, converged, niter, nfev = _lambert_seed(z0, bracket, tsec, r1pr2,
+            A, mu, solve)
+        cold = solve & ~converged
+        if not fallback:
+            seeded = np.zeros(n, dtype=bool)
+            if z0 is not None:
+                seeded |= np.isfinite(np.broadcast_to(np.asarray(z0,
+                    dtype=float), (n,)))
+            if bracket is not None:
+                seeded |= np.isfinite(np.broadcast_to(np.asarray(bracket,
+                    dtype=float), (n, 2))).all(axis=1)
+            status[cold & seeded] = LAMBERT_NO_SOLUTION
+            cold &= ~seeded
+        fallbacks = int(np.count_nonzero(cold))
+        if fallbacks:
+            substat = status[cold]
+            zn[cold], citer, cfev = _lambert_zero_rev(tsec[cold], r1pr2[cold],
+                A[cold], dnu[cold], mu, substat)
+            status[cold] = substat
+            niter += citer
+            nfev += cfev
+    solve = status == LAMBERT_OK
+    ivel, tvel = _lambert_velocity(zn, sipos, stpos, r1, r2, A, r1pr2, mu)
+    status[solve & ~(np.isfinite(ivel).all(axis=1) \
+        & np.isfinite(tvel).all(axis=1))] = LAMBERT_NO_SOLUTION
+    ivel[status != LAMBERT_OK] = np.nan
+    tvel[status != LAMBERT_OK] = np.nan
+    
+    if _stats is not None:
+        _stats.record('lambert_batch', niter, int(nfev), fallbacks,
+            time.perf_counter() - start)
+
+    if full_output:
+        return ivel, tvel, status, np.where(status == LAMBERT_OK, zn, np.nan)
+    return ivel, tvel, status
+
+
+def lambert_multirev(ipos, tpos, targett, mu=1.32712440041e20, ccw=True,
+                     maxrev=1):
+    """A function to solve many multi-revolution 'Lambert's Problems'
+    
+    Solves the zero-revolution problem and both branches of every number
+    of revolutions from 1 to maxrev.  Geometry of each problem is computed
+    once and shared by all branches, and each branch is solved for all
+    problems together.
+    Args: ipos, tpos, targett, mu, ccw, maxrev
+        ipos: Initial positions of the objects, (N,3) array-like object
+        tpos: Terminal positions of the objects, (N,3) array-like object
+        targett: Flight times, array-like object of N elements (or a scalar)
+        mu: Gravitational parameter of the central body (default value is for the Sun)
+        ccw: Flag for orbital direction, or array of N flags. If True,
+             counter clockwise
+        maxrev: Maximum number of complete revolutions
+    Returns: ivel, tvel, status
+        ivel: Initial velocities of the objects, (N,2*maxrev+1,3) Numpy array
+        tvel: Terminal velocities of the objects, (N,2*maxrev+1,3) Numpy array
+        status: Status codes, (N,2*maxrev+1) Numpy array of integers (see
+                lambert_batch)
+            Column 0 is the zero-revolution solution; columns 2*k-1 and
+            2*k are the left branch and the right branch of k revolutions.
+            The left branch has smaller z (larger semi-major axis) than the
+            transfer of minimum flight time. Infeasible branches (flight
+            time shorter than the minimum) are LAMBERT_NO_SOLUTION.
+        
+        Origin of coordinates are position of the central body
+    """
+    start = time.perf_counter() if _stats is not None else 0.0
+    sipos = np.array(ipos, dtype=float).reshape(-1, 3)
+    stpos = np.array(tpos, dtype=float).reshape(-1, 3)
+    n = sipos.shape[0]
+    tsec = np.broadcast_to(np.asarray(targett, dtype=float), (n,))
+    ccw = np.broadcast_to(np.asarray(ccw, dtype=bool), (n,))
+    
+    r1, r2, A, r1pr2, dnu, geostat = _lambert_geometry(sipos, stpos, ccw)
+    zall = np.empty((n, 2 * maxrev + 1))
+    status = np.empty((n, 2 * maxrev + 1), dtype=geostat.dtype)
+    status[:, 0] = geostat
+    zall[:, 0], niter, nfev = _lambert_zero_rev(tsec, r1pr2, A, dnu, mu,
+        status[:, 0])
+    solve = geostat == LAMBERT_OK
+    for k in range(1, maxrev + 1):
+        zleft, zright, feasible, kiter, kfev = _lambert_branches(k, tsec,
+            r1pr2, A, mu, solve)
+        zall[:, 2 * k - 1] = zleft
+        zall[:, 2 * k] = zright
+        status[:, 2 * k - 1] = np.where(feasible, LAMBERT_OK,
+            np.where(solve, LAMBERT_NO_SOLUTION, geostat))
+        status[:, 2 * k] = status[:, 2 * k - 1]
+        niter += kiter
+        nfev += kfev
+    
+    m = 2 * maxrev + 1
+    ivel, tvel = _lambert_velocity(zall.ravel(), np.repeat(sipos, m, axis=0),
+        np.repeat(stpos, m, axis=0), np.repeat(r1, m), np.repeat(r2, m),
+        np.repeat(A, m), np.repeat(r1pr2, m), mu)
+    ivel = ivel.reshape(n, m, 3)
+    tvel = tvel.reshape(n, m, 3)
+    status[(status == LAMBERT_OK) & ~(np.isfinite(ivel).all(axis=2) \
+        & np.isfinite(tvel).all(axis=2))] = LAMBERT_NO_SOLUTION
+    ivel[status != LAMBERT_OK] = np.nan
+    tvel[status != LAMBERT_OK] = np.nan
+    
+    if _stats is not None:
+        _stats.record('lambert_multirev', niter, nfev, 0,
+            time.perf_counter() - start)
+
+    return ivel, tvel, status
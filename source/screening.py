@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Close-approach (conjunction) screening of many two-body orbits
+
+This module finds times and distances of closest approach of all pairs of
+objects, which orbit around the same central body, that come closer than a
+threshold distance within a time span.
+
+Screening proceeds in three stages:
+  1. Perigee/apogee filter: objects whose radial shells [periapsis distance,
+     apoapsis distance] do not overlap any other shell (within the
+     threshold) are dropped, and so are pairs of objects whose shells do
+     not overlap.
+  2. Spatial index: the time span is divided into buckets.  For each bucket,
+     a k-d tree of positions at the middle of the bucket is queried for
+     pairs within the threshold plus the largest possible relative motion
+     in half a bucket (bounded by speeds at periapsis).  Candidates are
+     narrowed by linear relative motion around the middle of the bucket,
+     with the deviation bounded by accelerations at periapsis.
+  3. Root finding: for each candidate pair, a minimum of range is bracketed
+     by the sign change of range-rate at the ends of the bucket, and is
+     located by scipy.optimize.brentq.
+
+Buckets should be short compared with orbital periods, so that range of a
+pair has at most one minimum in a bucket.
+
+@author: Shushi Uetsuki/whiskie14142
+"""
+
+import numpy as np
+from scipy.optimize import brentq
+from scipy.spatial import cKDTree
+from pytwobodyorbit import OrbitSet
+
+
+def _shells(orbits):
+    """Periapsis and apoapsis distances of members of an OrbitSet"""
+    peri = orbits.p / (1.0 + orbits.e)
+    with np.errstate(divide='ignore'):
+        apo = np.where(orbits.e < 1.0, orbits.p / (1.0 - orbits.e), np.inf)
+    return peri, apo
+
+
+def _overlapping(peri, apo, threshold):
+    """Flags of objects whose shells overlap a shell of another object"""
+    speri = np.sort(peri)
+    sapo = np.sort(apo)
+    # objects j with peri[j] <= apo[i] + threshold, less those with
+    # apo[j] < peri[i] - threshold, less the object itself
+    count = np.searchsorted(speri, apo + threshold, side='right') \
+        - np.searchsorted(sapo, peri - threshold, side='left') - 1
+    return count > 0
+
+
+def screen(orbits, t1, t2, threshold, step=None):
+    """Finds close approaches of all pairs of objects within a time span
+
+    Args:
+        orbits: OrbitSet instance, or sequence of TwoBodyOrbit instances
+                (with the same gravitational parameter)
+        t1: Start time of the span
+        t2: End time of the span
+        threshold: Threshold distance of close approaches
+        step: Length of time buckets. If None, 1/32 of the shortest
+              orbital period of the objects (or 1/64 of the span, if all
+              objects are hyperbolic) is used
+    Returns: approaches
+        approaches: Dictionary of Numpy arrays, one element per close
+                    approach, sorted by time. Keys are as follows
+            'i', 'j': Indices of the two objects (i < j)
+            'tca': Time of closest approach
+            'dca': Distance of closest approach
+            'vrel': Relative speed at closest approach
+
+            Approaches at t1 (or t2), where range is increasing (or
+            decreasing), are reported at t1 (or t2).
+    Exception:
+        RuntimeError: If it failed to the computation, raises RuntimeError
+    """
+    if not isinstance(orbits, OrbitSet):
+        orbitset = OrbitSet(mu=orbits[0].mu)
+        orbitset.setOrbList(orbits)
+        orbits = orbitset
+
+    # stage 1: perigee/apogee filter of objects
+    peri, apo = _shells(orbits)
+    index = np.flatnonzero(_overlapping(peri, apo, threshold))
+    result = {'i':[], 'j':[], 'tca':[], 'dca':[], 'vrel':[]}
+    if index.size >= 2:
+        members = OrbitSet(mu=orbits.mu)
+        members.setOrbCart(orbits.t0[index], orbits.pos[index],
+            orbits.vel[index])
+        _screenMembers(members, index, peri[index], apo[index], t1, t2,
+            threshold, step, result)
+
+    order = np.argsort(result['tca'], kind='stable')
+    return {key:np.array(value, dtype=int if key in ('i', 'j') else float)
+            [order] for key, value in result.items()}
+
+
+def _screenMembers(members, index, peri, apo, t1, t2, threshold, step,
+                   result):
+    """Stages 2 and 3 of screen(); close approaches are appended to result"""
+    if step is None:
+        periods = members.pr[np.isfinite(members.pr)]
+        step = periods.min() / 32.0 if periods.size else (t2 - t1) / 64.0
+    nbucket = max(1, int(np.ceil((t2 - t1) / step)))
+    grid = np.linspace(t1, t2, nbucket + 1)
+
+    # upper bounds of speeds and accelerations are those at periapsis
+    vperi = np.sqrt(members.mu * (2.0 / peri - 1.0 / members.a))
+    accperi = members.mu / peri / peri
+    orbitcache = {}
+
+    def _orbit(k):
+        if k not in orbitcache:
+            orbitcache[k] = members.orbit(k)
+        return orbitcache[k]
+
+    def _rangerate(t, i, j):
+        posi, veli = _orbit(i).posvelatt(t)
+        posj, velj = _orbit(j).posvelatt(t)
+        return np.dot(posi - posj, veli - velj)
+
+    def _append(i, j, t, dpos, dvel):
+        result['i'].append(index[i])
+        result['j'].append(index[j])
+        result['tca'].append(t)
+        result['dca'].append(np.sqrt(np.dot(dpos, dpos)))
+        result['vrel'].append(np.sqrt(np.dot(dvel, dvel)))
+
+    posa, vela = members.posvelatt(grid[0])
+    for k in range(nbucket):
+        ta = grid[k]
+        tb = grid[k + 1]
+        half = (tb - ta) / 2.0
+        posm, velm = members.posvelatt(ta + half)
+        posb, velb = members.posvelatt(tb)
+
+        # stage 2: k-d tree of positions at the middle of the bucket
+        tree = cKDTree(posm)
+        pairs = tree.query_pairs(threshold + half * 2.0 * vperi.max(),
+            output_type='ndarray')
+        if pairs.shape[0] > 0:
+            i = pairs[:, 0]
+            j = pairs[:, 1]
+            # relative motion is linear around the middle of the bucket,
+            # within the bound of accelerations at periapsis
+            dpos = posm[i] - posm[j]
+            dvel = velm[i] - velm[j]
+            with np.errstate(invalid='ignore'):
+                tau = np.clip((-1.0) * np.sum(dpos * dvel, axis=1)
+                    / np.sum(dvel * dvel, axis=1), -half, half)
+            tau = np.where(np.isnan(tau), 0.0, tau)
+            dlin = np.sqrt(np.sum((dpos + dvel * tau[:, None]) ** 2, axis=1))
+            keep = (dlin - half * half * (accperi[i] + accperi[j]) / 2.0
+                <= threshold) \
+                & (np.maximum(peri[i], peri[j]) - np.minimum(apo[i], apo[j])
+                <= threshold)
+            i = i[keep]
+            j = j[keep]
+            rra = np.sum((posa[i] - posa[j]) * (vela[i] - vela[j]), axis=1)
+            rrb = np.sum((posb[i] - posb[j]) * (velb[i] - velb[j]), axis=1)
+
+            # stage 3: minima of range within the bucket
+            for n in np.flatnonzero((rra < 0.0) & (rrb >= 0.0)):
+                tca = brentq(_rangerate, ta, tb, args=(i[n], j[n]))
+                posi, veli = _orbit(i[n]).posvelatt(tca)
+                posj, velj = _orbit(j[n]).posvelatt(tca)
+                if np.sqrt(np.dot(posi - posj, posi - posj)) <= threshold:
+                    _append(min(i[n], j[n]), max(i[n], j[n]), tca,
+                        posi - posj, veli - velj)
+
+            # minima at the ends of the span
+            if k == 0:
+                for n in np.flatnonzero(rra >= 0.0):
+                    dpos = posa[i[n]] - posa[j[n]]
+                    if np.sqrt(np.dot(dpos, dpos)) <= threshold:
+                        _append(min(i[n], j[n]), max(i[n], j[n]), ta, dpos,
+                            vela[i[n]] - vela[j[n]])
+            if k == nbucket - 1:
+                for n in np.flatnonzero(rrb < 0.0):
+                    dpos = posb[i[n]] - posb[j[n]]
+                    if np.sqrt(np.dot(dpos, dpos)) <= threshold:
+                        _append(min(i[n], j[n]), max(i[n], j[n]), tb, dpos,
+                            velb[i[n]] - velb[j[n]])
+        posa = posb
+        vela = velb